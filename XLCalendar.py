@@ -12,21 +12,75 @@ General Options:
     -v, --version       Display version.
     -s <M> <YYYY>       Start calendar with month <M> of year <YYYY>. (Default: month 1 of current year)
     -e <M> <YYYY>       End calendar with month <M> of year <YYYY>. (Default: month 1 of next year)
-    -o <output_file>    Use <output_file> as filename. (Default: 'Calendar.xlsx')
+    -o <output_file>    Use <output_file> as filename, or '-' to write the file to stdout.
+                        (Default: 'Calendar.xlsx')
     -wr <%>             Resize column widths to <%> percent.
     -hr <%>             Resize row heights to <%> percent.
-    -f <nl | fr>        Force day and month names to NL or FR. (Default: OS locale)
+    -f <lang>           Force day and month names to language <lang>: en, nl, fr, de, es, it, pt, da, nb, sv, fi,
+                        pl, cs, hu, ro, tr, el, ru or id. (Default: OS locale, else en)
     -mnl                Mark NL general holidays.
+    -m <set>            Mark the holidays of holiday set <set>: nl, be, de, fr, gb, us or a set loaded with
+                        --holiday-rules. Repeat to stack sets, each marked with its own fill color.
+    --holiday-rules <file>
+                        Load holiday sets from the JSON <file>.
+    --mark <file>       Mark the dates and date ranges listed in the CSV or ICS <file>, with a fill color per
+                        category. Repeat to mark the dates of several files.
+    -r <std | lowmem | native>
+                        Render with the standard or the low memory (write-only) workbook, or write the
+                        file natively without openpyxl. (Default: std)
+    --extend <file>     Append the weeks up to the end date of '-e' to the calendar workbook <file>, saved in
+                        place unless '-o' is given. Mark holidays and dates again with the same options.
+    --band <year | N>   Split the calendar into bands of a year or of <N> weeks, each with its own year header,
+                        stacked on one sheet. Calendars in bands are not limited to 100 years.
+    --band-sheets       Put every band on a sheet of its own.
+    -z <0-9>            Compress the XLSX file with level <0-9>, from 0 (stored uncompressed, the fastest to save)
+                        to 9 (the smallest file). (Default: 6)
+    -x <xlsx | csv | jsonl | ics>
+                        Export to an Excel workbook, or stream the days with their week numbers and holiday
+                        flags to CSV or JSON Lines, or the holidays to iCalendar. Only XLSX calendars
+                        without bands are limited to 100 years. (Default: xlsx)
+
+Cache Options:
+    --no-cache          Always render, do not use or fill the output cache.
+    --cache-dir <dir>   Keep the output cache in <dir>. (Default: user cache directory)
+    --cache-stats       Display output cache statistics and exit.
+
+Profiling Options:
+    --profile           Display a JSON report with the time spent per phase and the numbers of cells, merges,
+                        styles, bands and bytes written. Bypasses the output cache.
+    --profile-dump <file>
+                        Like --profile, and also write cProfile statistics to <file>.
+
+Batch Options:
+    -b <manifest>       Render all calendars listed in a JSON or CSV <manifest> file. Other calendar options
+                        are ignored.
+    -j <N>              Render batches, served calendars or the bands of a native calendar with <N> worker
+                        processes. (Default: number of CPUs)
+
+Server Options:
+    --serve <[host:]port>
+                        Serve calendars over HTTP on <port>, described by query parameters. Other calendar
+                        options are ignored. (Default host: 127.0.0.1)
+    --serve-cache <MB>  Keep up to <MB> megabytes of served files in memory. (Default: 64)
 """
 
 
+# Only what the command line handling needs is imported here. The rendering stack (openpyxl, zipfile) and the
+# modules of the cache and batch features are imported by the functions using them, so '-h', '-v' and argument
+# errors return without loading them.
 import datetime
+import io
+import os
 import re
-from math import floor
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate, chain, groupby, islice
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple, Sequence, TextIO
+from math import floor, isfinite
 from sys import argv, exit
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
 
 
 # Default settings
@@ -42,7 +96,26 @@ opt = {
     "OUTPUT_FILE": f"Calendar.xlsx",
     "OUTPUT_FILE_SET": False,
     "VERSION": 1.12,
-    "NL_HOLIDAYS": False,
+    "HOLIDAYS": [],
+    "HOLIDAY_FILES": [],
+    "MARK_FILES": [],
+    "RENDERER": "std",
+    "FORMAT": "xlsx",
+    "EXTEND_FILE": None,
+    "COMPRESS_LEVEL": None,
+    "BAND": None,
+    "BAND_SHEETS": False,
+    "BATCH_FILE": None,
+    "WORKERS": os.cpu_count() or 1,
+    "CACHE_DIR": os.path.join(os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+                              or os.path.join(os.path.expanduser("~"), ".cache"), "XLCalendar"),
+    "CACHE_MAX_BYTES": 256 * 1024 * 1024,
+    "NO_CACHE": False,
+    "CACHE_STATS": False,
+    "PROFILE": False,
+    "PROFILE_DUMP": None,
+    "SERVE": None,
+    "SERVE_CACHE_BYTES": 64 * 1024 * 1024,
     "HELP_TEXT": """
 Tiny Calendar - Create handy calendars to print from Excel
 
@@ -54,41 +127,80 @@ General Options:
     -v, --version       Display version.
     -s <M> <YYYY>       Start calendar with month <M> of year <YYYY>. (Default: month 1 of current year)
     -e <M> <YYYY>       End calendar with month <M> of year <YYYY>. (Default: month 1 of next year)
-    -o <output_file>    Use <output_file> as filename. (Default: 'Calendar.xlsx')
+    -o <output_file>    Use <output_file> as filename, or '-' to write the file to stdout.
+                        (Default: 'Calendar.xlsx')
     -wr <%>             Resize column widths to <%> percent.
     -hr <%>             Resize row heights to <%> percent.
-    -f <nl | fr>        Force day and month names to NL or FR. (Default: OS locale)
+    -f <lang>           Force day and month names to language <lang>: en, nl, fr, de, es, it, pt, da, nb, sv, fi,
+                        pl, cs, hu, ro, tr, el, ru or id. (Default: OS locale, else en)
     -mnl                Mark NL general holidays.
+    -m <set>            Mark the holidays of holiday set <set>: nl, be, de, fr, gb, us or a set loaded with
+                        --holiday-rules. Repeat to stack sets, each marked with its own fill color.
+    --holiday-rules <file>
+                        Load holiday sets from the JSON <file>.
+    --mark <file>       Mark the dates and date ranges listed in the CSV or ICS <file>, with a fill color per
+                        category. Repeat to mark the dates of several files.
+    -r <std | lowmem | native>
+                        Render with the standard or the low memory (write-only) workbook, or write the
+                        file natively without openpyxl. (Default: std)
+    --extend <file>     Append the weeks up to the end date of '-e' to the calendar workbook <file>, saved in
+                        place unless '-o' is given. Mark holidays and dates again with the same options.
+    --band <year | N>   Split the calendar into bands of a year or of <N> weeks, each with its own year header,
+                        stacked on one sheet. Calendars in bands are not limited to 100 years.
+    --band-sheets       Put every band on a sheet of its own.
+    -z <0-9>            Compress the XLSX file with level <0-9>, from 0 (stored uncompressed, the fastest to save)
+                        to 9 (the smallest file). (Default: 6)
+    -x <xlsx | csv | jsonl | ics>
+                        Export to an Excel workbook, or stream the days with their week numbers and holiday
+                        flags to CSV or JSON Lines, or the holidays to iCalendar. Only XLSX calendars
+                        without bands are limited to 100 years. (Default: xlsx)
+
+Cache Options:
+    --no-cache          Always render, do not use or fill the output cache.
+    --cache-dir <dir>   Keep the output cache in <dir>. (Default: user cache directory)
+    --cache-stats       Display output cache statistics and exit.
+
+Profiling Options:
+    --profile           Display a JSON report with the time spent per phase and the numbers of cells, merges,
+                        styles, bands and bytes written. Bypasses the output cache.
+    --profile-dump <file>
+                        Like --profile, and also write cProfile statistics to <file>.
+
+Batch Options:
+    -b <manifest>       Render all calendars listed in a JSON or CSV <manifest> file. Other calendar options
+                        are ignored.
+    -j <N>              Render batches, served calendars or the bands of a native calendar with <N> worker
+                        processes. (Default: number of CPUs)
+
+Server Options:
+    --serve <[host:]port>
+                        Serve calendars over HTTP on <port>, described by query parameters. Other calendar
+                        options are ignored. (Default host: 127.0.0.1)
+    --serve-cache <MB>  Keep up to <MB> megabytes of served files in memory. (Default: 64)
 """
 }
 
 # Define styling templates
-font_standard = Font(name="Arial", size=10, bold=False)
-font_bold = Font(name="Arial", size=10, bold=True)
+# openpyxl is only imported once a workbook is rendered through it (see get_font() and friends), so the
+# templates are plain data here and keyed the same way as in the sheet layouts.
+# Fonts as (name, size, bold)
+font_dict = {"standard": ("Arial", 10, False), "bold": ("Arial", 10, True)}
 
-h_align_center = Alignment(horizontal="center", vertical="center")
-h_align_right = Alignment(horizontal="right", vertical="center")
+# Horizontal alignments, all cells are centered vertically
+h_align_center = "center"
+h_align_right = "right"
 
-fill_white = PatternFill("solid", fgColor="FFFFFF")
-fill_lightgrey = PatternFill("solid", fgColor="F2F2F2")
-fill_mediumgrey = PatternFill("solid", fgColor="D9D9D9")
+# Solid fills by color
+fill_white = "FFFFFF"
+fill_lightgrey = "F2F2F2"
+fill_mediumgrey = "D9D9D9"
 
-thin = Side(border_style="thin", color="000000")
-medium = Side(border_style="medium", color="000000")
-
-border_LrTb = Border(left=medium, right=thin, top=medium, bottom=thin)
-border_Lr = Border(left=medium, right=thin)
-border_LrtB = Border(left=medium, right=thin, top=thin, bottom=medium)
-border_lrTb = Border(left=thin, right=thin, top=medium, bottom=thin)
-border_lRTb = Border(left=thin, right=medium, top=medium, bottom=thin)
-border_lt = Border(left=thin, top=thin)
-border_l = Border(left=thin)
-border_R = Border(right=medium)
-border_lrtB = Border(left=thin, right=thin, top=thin, bottom=medium)
-border_lRtB = Border(left=thin, right=medium, top=thin, bottom=medium)
-border_lRt = Border(left=thin, right=medium, top=thin)
-border_lR = Border(left=thin, right=medium)
+# Fills given in turn to the categories of marked dates without a fill of their own
+mark_fills = ("9BC2E6", "F4B084", "A9D08E", "FFD966", "C9A0DC", "8EA9DB", "FF9999", "B4C6E7")
 
+# Borders by a key like 'LrTb': one letter per side (left, right, top, bottom), lowercase for a thin line and
+# uppercase for a medium line
+border_sides = {"l": "left", "r": "right", "t": "top", "b": "bottom"}
 
 def main() -> None:
     # Process command line arguments
@@ -169,10 +281,16 @@ def main() -> None:
             elif arg == "-o":
                 try:
                     file_name = cl_args.pop()
-                    if not re.fullmatch(r"^[0-9a-zA-Z_\-][0-9a-zA-Z_\-. ]*$", file_name):
+                    if file_name == "-":
+                        # Only the file goes to stdout, so it can be piped, and messages go to stderr
+                        opt['OUTPUT_FILE'] = file_name
+                        sys.stdout = sys.stderr
+                    elif not re.fullmatch(r"^[0-9a-zA-Z_\-][0-9a-zA-Z_\-. ]*$", file_name):
                         print(f"\nERROR: Provided filename is not a valid Windows filename.")
                         help_and_exit()
-                    opt['OUTPUT_FILE'] = file_name if re.fullmatch(r"^.*\.xlsx$", file_name) else file_name + ".xlsx"
+                    else:
+                        opt['OUTPUT_FILE'] = (file_name if re.fullmatch(r"^.*\.xlsx$", file_name)
+                                              else file_name + ".xlsx")
                     opt['OUTPUT_FILE_SET'] = True
                 except IndexError:
                     print(f"\nERROR: Option '-o' requires positional argument <output_file>.")
@@ -210,30 +328,252 @@ def main() -> None:
                     print(f"\nERROR: Option '-hr' positional argument <%> should be a number > 0.")
                     help_and_exit()
 
-            # Option: -f <nl | fr>
+            # Option: -f <lang>
             elif arg == "-f":
                 try:
-                    lang = cl_args.pop()
-                    if lang.lower() == "nl":
-                        opt['FORCE_LANG'] = "nl"
-                    elif lang.lower() == "fr":
-                        opt['FORCE_LANG'] = "fr"
+                    lang = cl_args.pop().lower()
+                    if lang in get_locale_catalog():
+                        opt['FORCE_LANG'] = lang
                     else:
-                        print(f"\nERROR: Option '-f' positional argument <nl | fr> should be one of two options")
+                        print(f"\nERROR: Option '-f' positional argument <lang> should be one of: "
+                              f"{', '.join(get_locale_catalog())}.")
                         help_and_exit()
                 except IndexError:
-                    print(f"\nERROR: Option '-f' requires positional argument <nl | fr>.")
+                    print(f"\nERROR: Option '-f' requires positional argument <lang>.")
                     help_and_exit()
 
             # Option: -mnl
             elif arg == "-mnl":
-                opt['NL_HOLIDAYS'] = True
+                if "nl" not in opt['HOLIDAYS']:
+                    opt['HOLIDAYS'].append("nl")
+
+            # Option: -m <set>
+            elif arg == "-m":
+                try:
+                    holiday_set = cl_args.pop()
+                    if holiday_set not in opt['HOLIDAYS']:
+                        opt['HOLIDAYS'].append(holiday_set)
+                except IndexError:
+                    print(f"\nERROR: Option '-m' requires positional argument <set>.")
+                    help_and_exit()
+
+            # Option: --holiday-rules <file>
+            elif arg == "--holiday-rules":
+                try:
+                    file_name = cl_args.pop()
+                    load_holiday_sets(file_name)
+                    opt['HOLIDAY_FILES'].append(file_name)
+                except IndexError:
+                    print(f"\nERROR: Option '--holiday-rules' requires positional argument <file>.")
+                    help_and_exit()
+                except OSError:
+                    print(f"\nERROR: Can't read holiday rules file '{file_name}'.")
+                    exit()
+                except ValueError as e:
+                    print(f"\nERROR: Invalid holiday rules file '{file_name}': {e}")
+                    exit()
+
+            # Option: -r <std | lowmem | native>
+            elif arg == "-r":
+                try:
+                    renderer = cl_args.pop()
+                    if renderer.lower() in ("std", "lowmem", "native"):
+                        opt['RENDERER'] = renderer.lower()
+                    else:
+                        print(f"\nERROR: Option '-r' positional argument <std | lowmem | native> should be one of three options")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '-r' requires positional argument <std | lowmem | native>.")
+                    help_and_exit()
+
+            # Option: --mark <file>
+            elif arg == "--mark":
+                try:
+                    file_name = cl_args.pop()
+                    load_marks(file_name)
+                    opt['MARK_FILES'].append(file_name)
+                except IndexError:
+                    print(f"\nERROR: Option '--mark' requires positional argument <file>.")
+                    help_and_exit()
+                except OSError:
+                    print(f"\nERROR: Can't read mark file '{file_name}'.")
+                    exit()
+                except ValueError as e:
+                    print(f"\nERROR: Invalid mark file: {e}")
+                    exit()
+
+            # Option: --extend <file>
+            elif arg == "--extend":
+                try:
+                    opt['EXTEND_FILE'] = cl_args.pop()
+                except IndexError:
+                    print(f"\nERROR: Option '--extend' requires positional argument <file>.")
+                    help_and_exit()
+
+            # Option: --band <year | N>
+            elif arg == "--band":
+                try:
+                    band = cl_args.pop().lower()
+                    if band == "year":
+                        opt['BAND'] = band
+                    elif band.isdigit() and 1 <= int(band) <= max_band_weeks:
+                        opt['BAND'] = int(band)
+                    else:
+                        print(f"\nERROR: Option '--band' positional argument <year | N> should be 'year' or a number of weeks from 1 to {max_band_weeks}.")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '--band' requires positional argument <year | N>.")
+                    help_and_exit()
+
+            # Option: --band-sheets
+            elif arg == "--band-sheets":
+                opt['BAND_SHEETS'] = True
+
+            # Option: -z <0-9>
+            elif arg == "-z":
+                try:
+                    compress_level = int(cl_args.pop())
+                    if 0 <= compress_level <= 9:
+                        opt['COMPRESS_LEVEL'] = compress_level
+                    else:
+                        print(f"\nERROR: Option '-z' positional argument <0-9> should be a number from 0 to 9.")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '-z' requires positional argument <0-9>.")
+                    help_and_exit()
+                except ValueError:
+                    print(f"\nERROR: Option '-z' positional argument <0-9> should be a number from 0 to 9.")
+                    help_and_exit()
+
+            # Option: -x <xlsx | csv | jsonl | ics>
+            elif arg == "-x":
+                try:
+                    export_format = cl_args.pop()
+                    if export_format.lower() in ("xlsx", "csv", "jsonl", "ics"):
+                        opt['FORMAT'] = export_format.lower()
+                    else:
+                        print(f"\nERROR: Option '-x' positional argument <xlsx | csv | jsonl | ics> should be one of four options")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '-x' requires positional argument <xlsx | csv | jsonl | ics>.")
+                    help_and_exit()
+
+            # Option: --no-cache
+            elif arg == "--no-cache":
+                opt['NO_CACHE'] = True
+
+            # Option: --cache-dir <dir>
+            elif arg == "--cache-dir":
+                try:
+                    opt['CACHE_DIR'] = cl_args.pop()
+                except IndexError:
+                    print(f"\nERROR: Option '--cache-dir' requires positional argument <dir>.")
+                    help_and_exit()
+
+            # Option: --cache-stats
+            elif arg == "--cache-stats":
+                opt['CACHE_STATS'] = True
+
+            # Option: --profile
+            elif arg == "--profile":
+                opt['PROFILE'] = True
+
+            # Option: --profile-dump <file>
+            elif arg == "--profile-dump":
+                try:
+                    opt['PROFILE_DUMP'] = cl_args.pop()
+                    opt['PROFILE'] = True
+                except IndexError:
+                    print(f"\nERROR: Option '--profile-dump' requires positional argument <file>.")
+                    help_and_exit()
+
+            # Option: --serve <[host:]port>
+            elif arg == "--serve":
+                try:
+                    address = cl_args.pop()
+                    host, _, port = address.rpartition(":")
+                    if port.isdigit() and 1 <= int(port) <= 65535:
+                        opt['SERVE'] = (host or "127.0.0.1", int(port))
+                    else:
+                        print(f"\nERROR: Option '--serve' positional argument <[host:]port> should end with a port number from 1 to 65535.")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '--serve' requires positional argument <[host:]port>.")
+                    help_and_exit()
+
+            # Option: --serve-cache <MB>
+            elif arg == "--serve-cache":
+                try:
+                    megabytes = int(cl_args.pop())
+                    if megabytes >= 0:
+                        opt['SERVE_CACHE_BYTES'] = megabytes * 1024 * 1024
+                    else:
+                        print(f"\nERROR: Option '--serve-cache' positional argument <MB> should be a number >= 0.")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '--serve-cache' requires positional argument <MB>.")
+                    help_and_exit()
+                except ValueError:
+                    print(f"\nERROR: Option '--serve-cache' positional argument <MB> should be a number >= 0.")
+                    help_and_exit()
+
+            # Option: -b <manifest>
+            elif arg == "-b":
+                try:
+                    opt['BATCH_FILE'] = cl_args.pop()
+                except IndexError:
+                    print(f"\nERROR: Option '-b' requires positional argument <manifest>.")
+                    help_and_exit()
+
+            # Option: -j <N>
+            elif arg == "-j":
+                try:
+                    workers = int(cl_args.pop())
+                    if workers > 0:
+                        opt['WORKERS'] = workers
+                    else:
+                        print(f"\nERROR: Option '-j' positional argument <N> should be a number > 0.")
+                        help_and_exit()
+                except IndexError:
+                    print(f"\nERROR: Option '-j' requires positional argument <N>.")
+                    help_and_exit()
+                except ValueError:
+                    print(f"\nERROR: Option '-j' positional argument <N> should be a number > 0.")
+                    help_and_exit()
 
             # Unsupported argument provided
             else:
                 print(f"\nERROR: No such option: {arg}")
                 help_and_exit()
 
+        if opt['CACHE_STATS']:
+            print_cache_stats()
+            exit()
+
+        # Holiday sets can be loaded after the option marking them
+        for holiday_set in opt['HOLIDAYS']:
+            if holiday_set not in holiday_sets:
+                print(f"\nERROR: Unknown holiday set '{holiday_set}'. Available: {', '.join(holiday_sets)}.")
+                help_and_exit()
+
+        # Calendars of the server are described by the query of every request
+        if opt['SERVE']:
+            serve_calendars()
+            return
+
+        # A batch brings its own calendar options
+        if opt['BATCH_FILE']:
+            create_batch_files()
+            return
+
+        # An extended calendar keeps its start date
+        if opt['EXTEND_FILE']:
+            if not opt['Y_E']:
+                print(f"\nERROR: Option '--extend' requires option '-e' for the new end date.")
+                help_and_exit()
+            extend_calendar_file()
+            return
+
         # Set end year to "start year + 1 " if no end year was provided
         if not opt['Y_E']:
             opt['Y_E'] = opt['Y_S'] + 1
@@ -248,11 +588,22 @@ def main() -> None:
             if opt['M_E'] < opt['M_S']:
                 print(f"\nERROR: End date is earlyer than start date.")
                 help_and_exit()
-        # Check maximum span of full calendar
-        elif opt['Y_E'] - opt['Y_S'] > 100:
-            print(f"\nERROR: Calendar cannot span more than 100 years.")
+        # Check maximum span of full calendar, exports are streamed and calendars in bands are not limited
+        elif opt['FORMAT'] == "xlsx" and opt['BAND'] is None and opt['Y_E'] - opt['Y_S'] > 100:
+            print(f"\nERROR: Calendar cannot span more than 100 years, unless it is split into bands with '--band'.")
+            help_and_exit()
+
+        # Check the datetime range
+        if opt['Y_E'] > 9999:
+            print(f"\nERROR: Calendar cannot end after the year 9999.")
             help_and_exit()
 
+        # Give the output file the extension of the export format
+        if opt['FORMAT'] != "xlsx" and opt['OUTPUT_FILE'] != "-":
+            opt['OUTPUT_FILE'] = re.sub(r"\.xlsx$", "", opt['OUTPUT_FILE'])
+            if not opt['OUTPUT_FILE'].endswith(f".{opt['FORMAT']}"):
+                opt['OUTPUT_FILE'] += f".{opt['FORMAT']}"
+
         # All options parsed and validated -> create the file
         print(f"\nCreating calendar running from {opt['M_S']}-{opt['Y_S']} to {opt['M_E']}-{opt['Y_E']}.")
         create_calendar_file()
@@ -264,14 +615,9 @@ def help_and_exit() -> None:
     exit()
 
 
-def get_week_info(date_in: datetime.date) -> tuple[int, int]:
-    # Returns the weeknumber and day-of-the-week for the given day
-    _, week_number, week_day = date_in.isocalendar()
-    return week_number, week_day
-
-
+@lru_cache(maxsize=None)
 def get_easter_date(year: int) -> datetime.date:
-    # Returns a date object of the first easter-day of the argumented year
+    # Returns a date object of the first easter-day of the argumented year (cached across calls)
     # Thank you rahulhegde97 for showing me this algorithm
     # https://www.geeksforgeeks.org/how-to-calculate-the-easter-date-for-a-given-year-using-gauss-algorithm/
 
@@ -309,251 +655,2525 @@ def get_easter_date(year: int) -> datetime.date:
             return datetime.date(year, 3, days)
 
 
-def get_holidays(year_start: int, year_end: int) -> list[datetime.date]:
-    # Returns a list with date objects of all NL holidays in the given timespan
-    holidays = []
-    for year in range(year_start, year_end + 1):
-        # New Year's Day
-        holidays.append(datetime.date(year, 1, 1))
-        # 1st and 2nd Easter days
-        easter = get_easter_date(year)
-        holidays.extend([easter, easter + datetime.timedelta(days=1)])
-        # Good Friday
-        holidays.append(easter - datetime.timedelta(days=2))
-        # Ascension Day
-        holidays.append(easter + datetime.timedelta(days=39))
-        # NL Kings Day
-        holidays.append(datetime.date(year, 4, 27))
-        # 1st and 2nd Pentecost Day
-        holidays.append(easter + datetime.timedelta(days=49))
-        holidays.append(easter + datetime.timedelta(days=50))
-        # 1st and 2nd Christmas Day
-        holidays.append(datetime.date(year, 12, 25))
-        holidays.append(datetime.date(year, 12, 26))
-    return holidays
+# Movable feasts by their offset in days from Easter Sunday
+movable_feasts = {"ash_wednesday": -46, "palm_sunday": -7, "maundy_thursday": -3, "good_friday": -2, "easter": 0,
+                  "easter_monday": 1, "ascension": 39, "pentecost": 49, "whit_monday": 50, "trinity_sunday": 56,
+                  "corpus_christi": 60}
 
 
-def create_calendar_file() -> None:
-    # Get localized day and month names
-    if opt['FORCE_LANG'] == "nl":
-        weekday_dict = {1: "Ma", 2: "Di", 3: "Wo", 4: "Do", 5: "Vr", 6: "Za", 7: "Zo", 8: "Week"}
-        month_dict = {1: "Januari", 2: "Februari", 3: "Maart", 4: "April", 5: "Mei", 6: "Juni", 7: "Juli",
-                      8: "Augustus", 9: "September", 10: "Oktober", 11: "November", 12: "December"}
-    elif opt['FORCE_LANG'] == "fr":
-        weekday_dict = {1: "Lun", 2: "Mar", 3: "Mer", 4: "Jeu", 5: "Ven", 6: "Ven", 7: "Dim", 8: "Sem"}
-        month_dict = {1: "Janvier", 2: "Février", 3: "Mars", 4: "Avril", 5: "Mai", 6: "Juin", 7: "Juillet",
-                      8: "Août", 9: "Septembre", 10: "Oktobre", 11: "Novembre", 12: "Décembre"}
+def get_easter_ordinals(years: Iterable[int]) -> array:
+    # Returns the ordinals of Easter Sunday in the given years, a range or array, as an array
+    # The same algorithm as get_easter_date() in integer arithmetic, with the terms of a century computed once per
+    # run of years in that century and no date objects, so thousands of years take milliseconds.
+    ordinals = array("i")
+    for p, century in groupby(years, lambda year: year // 100):
+        q = (13 + 8 * p) // 25
+        m = (15 - q + p - p // 4) % 30
+        n = (4 + p - p // 4) % 7
+        for year in century:
+            d = (19 * (year % 19) + m) % 30
+            e = (2 * (year % 4) + 4 * (year % 7) + 6 * d + n) % 7
+            # Easter Sunday is March (22 + d + e), a week earlier when d is 28 or 29 and e is 6
+            days = 22 + d + e - 7 * (e == 6 and d >= 28)
+            # March 1st follows the 59 or 60 days of January and February
+            y = year - 1
+            leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+            ordinals.append(y * 365 + y // 4 - y // 100 + y // 400 + 59 + leap + days)
+    return ordinals
+
+
+def get_movable_feasts(years: Iterable[int]) -> dict[str, array]:
+    # Returns the ordinals of every movable feast in the given years, a range or array, as arrays by feast name
+    easter = get_easter_ordinals(years)
+    return {name: array("i", [ordinal + offset for ordinal in easter]) for name, offset in movable_feasts.items()}
+
+
+# Holiday rule engine
+# Holiday sets are declared as data: a name, a fill color and a list of rules, in the same shape as the JSON files
+# loaded with load_holiday_sets(). A rule has a "name", a "type" and the fields of its type:
+#   fixed         "month" and "day"
+#   easter        "offset" in days from Easter Sunday
+#   nth_weekday   "month", "weekday" ("mon" to "sun") and "n": 1 for the first, -1 for the last of the month, etc.
+# and optionally an "offset" in days (for any type), "from" and "until" years and "substitute": the days to move the
+# holiday by when it falls on a given weekday, e.g. {"sun": 1} to move a Sunday holiday to Monday.
+# Rules are compiled once into HolidayRule tuples and evaluated once per holiday set and year into a table of
+# ordinals (see get_holiday_table()), never per day.
+weekday_keys = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+holiday_rule_types = ("fixed", "easter", "nth_weekday")
+# Timespans of at least this many years are evaluated per rule by get_holiday_index() instead of joined per year
+holiday_index_years = 5
+
+
+class HolidayRule(NamedTuple):
+    # A compiled holiday rule, substitute holds the days to move the holiday by for every ISO weekday
+    name: str
+    kind: str
+    month: int
+    day: int
+    weekday: int
+    n: int
+    offset: int
+    substitute: tuple[int, ...]
+    first_year: int
+    last_year: int
+
+
+class HolidaySet(NamedTuple):
+    # A compiled holiday set with the fill color of its holidays and the definition it was compiled from
+    name: str
+    fill: str
+    rules: tuple[HolidayRule, ...]
+    definition: dict
+
+
+builtin_holiday_sets = [
+    {"name": "nl", "fill": fill_mediumgrey, "rules": [
+        {"name": "Nieuwjaarsdag", "type": "fixed", "month": 1, "day": 1},
+        {"name": "Goede Vrijdag", "type": "easter", "offset": -2},
+        {"name": "Eerste Paasdag", "type": "easter", "offset": 0},
+        {"name": "Tweede Paasdag", "type": "easter", "offset": 1},
+        {"name": "Koninginnedag", "type": "fixed", "month": 4, "day": 30, "from": 1949, "until": 1979,
+         "substitute": {"sun": 1}},
+        {"name": "Koninginnedag", "type": "fixed", "month": 4, "day": 30, "from": 1980, "until": 2013,
+         "substitute": {"sun": -1}},
+        {"name": "Koningsdag", "type": "fixed", "month": 4, "day": 27, "from": 2014, "substitute": {"sun": -1}},
+        {"name": "Hemelvaartsdag", "type": "easter", "offset": 39},
+        {"name": "Eerste Pinksterdag", "type": "easter", "offset": 49},
+        {"name": "Tweede Pinksterdag", "type": "easter", "offset": 50},
+        {"name": "Eerste Kerstdag", "type": "fixed", "month": 12, "day": 25},
+        {"name": "Tweede Kerstdag", "type": "fixed", "month": 12, "day": 26},
+    ]},
+    {"name": "be", "fill": "F8CBAD", "rules": [
+        {"name": "Nieuwjaar", "type": "fixed", "month": 1, "day": 1},
+        {"name": "Pasen", "type": "easter", "offset": 0},
+        {"name": "Paasmaandag", "type": "easter", "offset": 1},
+        {"name": "Dag van de Arbeid", "type": "fixed", "month": 5, "day": 1},
+        {"name": "O.L.H. Hemelvaart", "type": "easter", "offset": 39},
+        {"name": "Pinksteren", "type": "easter", "offset": 49},
+        {"name": "Pinkstermaandag", "type": "easter", "offset": 50},
+        {"name": "Nationale feestdag", "type": "fixed", "month": 7, "day": 21},
+        {"name": "O.L.V. Hemelvaart", "type": "fixed", "month": 8, "day": 15},
+        {"name": "Allerheiligen", "type": "fixed", "month": 11, "day": 1},
+        {"name": "Wapenstilstand", "type": "fixed", "month": 11, "day": 11},
+        {"name": "Kerstmis", "type": "fixed", "month": 12, "day": 25},
+    ]},
+    {"name": "de", "fill": "FFE699", "rules": [
+        {"name": "Neujahr", "type": "fixed", "month": 1, "day": 1},
+        {"name": "Karfreitag", "type": "easter", "offset": -2},
+        {"name": "Ostermontag", "type": "easter", "offset": 1},
+        {"name": "Tag der Arbeit", "type": "fixed", "month": 5, "day": 1},
+        {"name": "Christi Himmelfahrt", "type": "easter", "offset": 39},
+        {"name": "Pfingstmontag", "type": "easter", "offset": 50},
+        {"name": "Tag der Deutschen Einheit", "type": "fixed", "month": 10, "day": 3, "from": 1990},
+        {"name": "1. Weihnachtstag", "type": "fixed", "month": 12, "day": 25},
+        {"name": "2. Weihnachtstag", "type": "fixed", "month": 12, "day": 26},
+    ]},
+    {"name": "fr", "fill": "BDD7EE", "rules": [
+        {"name": "Jour de l'an", "type": "fixed", "month": 1, "day": 1},
+        {"name": "Lundi de Pâques", "type": "easter", "offset": 1},
+        {"name": "Fête du Travail", "type": "fixed", "month": 5, "day": 1},
+        {"name": "Victoire 1945", "type": "fixed", "month": 5, "day": 8},
+        {"name": "Ascension", "type": "easter", "offset": 39},
+        {"name": "Lundi de Pentecôte", "type": "easter", "offset": 50},
+        {"name": "Fête nationale", "type": "fixed", "month": 7, "day": 14},
+        {"name": "Assomption", "type": "fixed", "month": 8, "day": 15},
+        {"name": "Toussaint", "type": "fixed", "month": 11, "day": 1},
+        {"name": "Armistice", "type": "fixed", "month": 11, "day": 11},
+        {"name": "Noël", "type": "fixed", "month": 12, "day": 25},
+    ]},
+    {"name": "gb", "fill": "C6E0B4", "rules": [
+        {"name": "New Year's Day", "type": "fixed", "month": 1, "day": 1, "substitute": {"sat": 2, "sun": 1}},
+        {"name": "Good Friday", "type": "easter", "offset": -2},
+        {"name": "Easter Monday", "type": "easter", "offset": 1},
+        {"name": "Early May bank holiday", "type": "nth_weekday", "month": 5, "weekday": "mon", "n": 1,
+         "from": 1978},
+        {"name": "Spring bank holiday", "type": "nth_weekday", "month": 5, "weekday": "mon", "n": -1, "from": 1971},
+        {"name": "Summer bank holiday", "type": "nth_weekday", "month": 8, "weekday": "mon", "n": -1, "from": 1971},
+        {"name": "Christmas Day", "type": "fixed", "month": 12, "day": 25, "substitute": {"sat": 2, "sun": 2}},
+        {"name": "Boxing Day", "type": "fixed", "month": 12, "day": 26, "substitute": {"sat": 2, "sun": 2}},
+    ]},
+    {"name": "us", "fill": "E4DFEC", "rules": [
+        {"name": "New Year's Day", "type": "fixed", "month": 1, "day": 1, "substitute": {"sat": -1, "sun": 1}},
+        {"name": "Martin Luther King Jr. Day", "type": "nth_weekday", "month": 1, "weekday": "mon", "n": 3,
+         "from": 1986},
+        {"name": "Washington's Birthday", "type": "nth_weekday", "month": 2, "weekday": "mon", "n": 3,
+         "from": 1971},
+        {"name": "Memorial Day", "type": "nth_weekday", "month": 5, "weekday": "mon", "n": -1, "from": 1971},
+        {"name": "Juneteenth", "type": "fixed", "month": 6, "day": 19, "from": 2021,
+         "substitute": {"sat": -1, "sun": 1}},
+        {"name": "Independence Day", "type": "fixed", "month": 7, "day": 4, "substitute": {"sat": -1, "sun": 1}},
+        {"name": "Labor Day", "type": "nth_weekday", "month": 9, "weekday": "mon", "n": 1},
+        {"name": "Columbus Day", "type": "nth_weekday", "month": 10, "weekday": "mon", "n": 2, "from": 1971},
+        {"name": "Veterans Day", "type": "fixed", "month": 11, "day": 11, "from": 1978,
+         "substitute": {"sat": -1, "sun": 1}},
+        {"name": "Thanksgiving Day", "type": "nth_weekday", "month": 11, "weekday": "thu", "n": 4, "from": 1942},
+        {"name": "Christmas Day", "type": "fixed", "month": 12, "day": 25, "substitute": {"sat": -1, "sun": 1}},
+    ]},
+]
+
+
+# Holiday sets that can be marked, by name
+holiday_sets = {}
+
+
+def compile_holiday_rule(definition: dict, set_name: str) -> HolidayRule:
+    # Returns the compiled holiday rule of the given definition, raises ValueError if it is not valid
+    name = definition.get("name", "Holiday")
+    where = f"holiday set '{set_name}', rule '{name}'"
+    kind = definition.get("type")
+    if kind not in holiday_rule_types:
+        raise ValueError(f"Unknown rule type {kind!r} in {where}, should be one of {', '.join(holiday_rule_types)}.")
+    try:
+        month = int(definition.get("month", 1))
+        day = int(definition.get("day", 1))
+        n = int(definition.get("n", 1))
+        offset = int(definition.get("offset", 0))
+        first_year = int(definition.get("from", 1))
+        last_year = int(definition.get("until", 9999))
+        weekday = weekday_keys.index(definition.get("weekday", "mon")) + 1
+        substitute = tuple(int(definition.get("substitute", {}).get(key, 0)) for key in weekday_keys)
+        unknown = set(definition.get("substitute", {})) - set(weekday_keys)
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError(f"Invalid field in {where}.") from None
+    if kind != "easter" and not 1 <= month <= 12:
+        raise ValueError(f"Month should be a number from 1 to 12 in {where}.")
+    if kind == "fixed" and not 1 <= day <= 31:
+        raise ValueError(f"Day should be a number from 1 to 31 in {where}.")
+    if kind == "nth_weekday" and not (1 <= n <= 5 or -5 <= n <= -1):
+        raise ValueError(f"n should be a number from 1 to 5 or from -5 to -1 in {where}.")
+    if unknown:
+        raise ValueError(f"Unknown weekday {sorted(unknown)[0]!r} in the substitutes of {where}.")
+    return HolidayRule(name, kind, month, day, weekday, n, offset, substitute, first_year, last_year)
+
+
+def add_holiday_set(definition: dict) -> str:
+    # Compiles the holiday set of the given definition and makes it available by its name, replacing a set of the
+    # same name. Returns the name, raises ValueError if the definition is not valid.
+    if not isinstance(definition, dict) or not re.fullmatch(r"[0-9a-zA-Z_\-]+", str(definition.get("name", ""))):
+        raise ValueError("A holiday set should be an object with a name of letters, digits, '_' and '-'.")
+    name = definition["name"]
+    fill = definition.get("fill", fill_mediumgrey)
+    if not isinstance(fill, str) or not re.fullmatch(r"[0-9a-fA-F]{6}", fill):
+        raise ValueError(f"Fill of holiday set '{name}' should be an RGB color like 'D9D9D9'.")
+    rules = definition.get("rules")
+    if not isinstance(rules, list):
+        raise ValueError(f"Holiday set '{name}' should have a list of rules.")
+    holiday_set = HolidaySet(name, fill.upper(), tuple(compile_holiday_rule(rule, name) for rule in rules), definition)
+
+    if name in holiday_sets:
+        # Tables of the replaced set are outdated
+        get_holiday_table.cache_clear()
+        get_holiday_names.cache_clear()
+        get_rule_index.cache_clear()
+    holiday_sets[name] = holiday_set
+    return name
+
+
+def load_holiday_sets(file_name: str) -> list[str]:
+    # Adds the holiday sets of a JSON file holding one holiday set or a list of them, returns their names
+    import json
+    with open(file_name, encoding="utf-8") as f:
+        data = json.load(f)
+    return [add_holiday_set(definition) for definition in (data if isinstance(data, list) else [data])]
+
+
+for definition in builtin_holiday_sets:
+    add_holiday_set(definition)
+
+
+def get_rule_ordinal(rule: HolidayRule, year: int) -> int | None:
+    # Returns the ordinal of the holiday of the rule in the given year, None if the rule does not apply that year
+    if not rule.first_year <= year <= rule.last_year:
+        return None
+    if rule.kind == "easter":
+        ordinal = get_easter_date(year).toordinal()
     else:
-        weekday_dict = {}
-        i = 1
-        for day in range(24, 31):
-            d = datetime.date(2023, 4, day)
-            weekday_dict[i] = d.strftime("%a")
-            i += 1
-        # weekday_dict[8] = "Week"
-        month_dict = {}
-        for month in range(1, 13):
-            d = datetime.date(2023, month, 1)
-            month_dict[month] = d.strftime("%B")
-
-    # Gather the list of holidays for marking
-    if opt['NL_HOLIDAYS']:
-        holidays = get_holidays(opt['Y_S'], opt['Y_E'])
-
-    # Get a list of days for the requested timespan
-    # per day: [datetime.date, weeknumber, weekday, is-holiday]
-    day_list = []
-    td = datetime.timedelta(days=1)
-    current_day = datetime.date(opt['Y_S'], opt['M_S'], 1)
-    if opt['M_E'] == 12:
-        last_day = datetime.date(opt['Y_E'] + 1, 1, 1) - td
+        length = get_month_length(year, rule.month)
+        first = datetime.date(year, rule.month, 1).toordinal()
+        if rule.kind == "fixed":
+            if rule.day > length:
+                return None
+            ordinal = first + rule.day - 1
+        else:
+            # Ordinal 1 is a Monday, so ordinal o falls on ISO weekday (o - 1) % 7 + 1
+            if rule.n > 0:
+                ordinal = first + (rule.weekday - first) % 7 + 7 * (rule.n - 1)
+            else:
+                last = first + length - 1
+                ordinal = last - (last - rule.weekday) % 7 + 7 * (rule.n + 1)
+            if not first <= ordinal < first + length:
+                return None
+    ordinal += rule.offset
+    return ordinal + rule.substitute[(ordinal - 1) % 7]
+
+
+def get_rule_ordinals(rule: HolidayRule, year_start: int, year_end: int) -> list[int]:
+    # Returns the ordinals of the holidays of the rule in the given timespan, like get_rule_ordinal() for every year
+    # but evaluated for all years in one pass per rule, on the year ordinals of get_year_ordinals()
+    first_year, last_year = max(year_start, rule.first_year), min(year_end, rule.last_year)
+    if first_year > last_year:
+        return []
+    new_years, leaps, easters = get_year_ordinals(year_start, year_end)
+    window = slice(first_year - year_start, last_year - year_start + 1)
+    if rule.kind == "easter":
+        ordinals = easters[window]
     else:
-        last_day = datetime.date(opt['Y_E'], opt['M_E'] + 1, 1) - td
+        # The first of the month in every year, the leap day counting from March on
+        days_before = sum(get_month_length(1, month) for month in range(1, rule.month))
+        if rule.month > 2:
+            firsts = [new_year + days_before + leap for new_year, leap in zip(new_years[window], leaps[window])]
+        else:
+            firsts = [new_year + days_before for new_year in new_years[window]]
+        length = get_month_length(1, rule.month)
+        lengths = [length + leap for leap in leaps[window]] if rule.month == 2 else [length] * len(firsts)
+        if rule.kind == "fixed":
+            ordinals = [first + rule.day - 1 for first in firsts]
+        elif rule.n > 0:
+            ordinals = [first + (rule.weekday - first) % 7 + 7 * (rule.n - 1) for first in firsts]
+        else:
+            ordinals = [first + length - 1 - (first + length - 1 - rule.weekday) % 7 + 7 * (rule.n + 1)
+                        for first, length in zip(firsts, lengths)]
+        # Every month has at least 28 days, so only later days and fifth weekdays can fall outside the month
+        if rule.kind == "fixed" and rule.day > 28 or rule.kind == "nth_weekday" and abs(rule.n) > 4:
+            ordinals = [ordinal for ordinal, first, length in zip(ordinals, firsts, lengths)
+                        if first <= ordinal < first + length]
+    offset, substitute = rule.offset, rule.substitute
+    if not any(substitute):
+        return [ordinal + offset for ordinal in ordinals]
+    return [ordinal + offset + substitute[(ordinal + offset - 1) % 7] for ordinal in ordinals]
 
-    if opt['NL_HOLIDAYS']:
-        while current_day <= last_day:
-            if current_day in holidays:
-                day_list.append([current_day, *get_week_info(current_day), 1])
-            else:
-                day_list.append([current_day, *get_week_info(current_day), 0])
-            current_day += td
+
+@lru_cache(maxsize=16)
+def get_year_ordinals(year_start: int, year_end: int) -> tuple[array, tuple[bool, ...], array]:
+    # Returns the ordinals of January 1st and of Easter Sunday and the leap year flags of the years in the given
+    # timespan, shared by the rules of get_rule_ordinals()
+    leaps = tuple(year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) for year in range(year_start, year_end + 1))
+    new_years = array("i", accumulate((365 + leap for leap in leaps[:-1]), initial=get_new_year_ordinal(year_start)))
+    return new_years, leaps, get_easter_ordinals(range(year_start, year_end + 1))
+
+
+@lru_cache(maxsize=4096)
+def get_holiday_table(year: int, holiday_set: str = "nl") -> tuple[int, ...]:
+    # Returns the sorted ordinals of the holidays of the holiday set in the given year, computed once per set and year
+    ordinals = (get_rule_ordinal(rule, year) for rule in holiday_sets[holiday_set].rules)
+    return tuple(sorted({o for o in ordinals if o is not None}))
+
+
+@lru_cache(maxsize=1024)
+def get_holiday_names(year: int, holiday_set: str = "nl") -> dict[int, str]:
+    # Returns the names of the holidays of the holiday set in the given year by ordinal
+    names = {}
+    for rule in holiday_sets[holiday_set].rules:
+        o = get_rule_ordinal(rule, year)
+        if o is not None:
+            names[o] = f"{names[o]} / {rule.name}" if o in names else rule.name
+    return names
+
+
+def get_holiday_index(year_start: int, year_end: int, holiday_set: str = "nl") -> frozenset[int]:
+    # Returns the ordinals of all holidays of the holiday set in the given timespan as a set for O(1) membership tests
+    # Short timespans are joined from the cached tables per year, long ones are evaluated per rule for all years at
+    # once, which builds the holidays of millennia in milliseconds.
+    if year_end - year_start < holiday_index_years:
+        return frozenset().union(*(get_holiday_table(year, holiday_set) for year in range(year_start, year_end + 1)))
+    return get_rule_index(year_start, year_end, holiday_set)
+
+
+@lru_cache(maxsize=64)
+def get_rule_index(year_start: int, year_end: int, holiday_set: str = "nl") -> frozenset[int]:
+    # Returns the ordinals of all holidays of the holiday set in the given timespan evaluated per rule, computed once
+    # per set and timespan
+    return frozenset(chain.from_iterable(get_rule_ordinals(rule, year_start, year_end)
+                                         for rule in holiday_sets[holiday_set].rules))
+
+
+def get_holiday_layers(first: int, last: int, holidays: Sequence[str]) -> list[frozenset[int]]:
+    # Returns a holiday index per holiday set for the days from ordinal first to last, holding the years of those
+    # days and the years around them, as rules may move holidays into the days from a neighbouring year
+    # Shared by the renderers, the exports, CalendarIndex and extending, so all mark the same days. Padding days past
+    # the datetime range count as 9999.
+    first_year = datetime.date.fromordinal(first).year
+    last_year = datetime.date.fromordinal(min(last, datetime.date.max.toordinal())).year
+    return [get_holiday_index(max(first_year - 1, 1), min(last_year + 1, 9999), name) for name in holidays]
+
+
+# Date marks
+# Mark files list dates and date ranges with a category, and every category is marked with its own fill. CSV files
+# have a header with the columns 'start' (or 'date'), 'end' (optional, inclusive), 'category' and 'fill' (optional).
+# In ICS files every event is a mark from DTSTART up to DTEND, with its first CATEGORIES value or else its SUMMARY
+# as category. Files are expanded once into a hash map from ordinal to category, so the render loop finds the mark
+# of a day with a single lookup.
+def load_marks(file_name: str) -> tuple[dict[int, str], dict[str, str | None]]:
+    # Returns the marks of a CSV or ICS file by ordinal and the fill given for every category (None if not given),
+    # loaded once until the file changes. Raises ValueError for invalid files.
+    stat = os.stat(file_name)
+    return load_marks_file(os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def load_marks_file(file_name: str, mtime_ns: int, size: int) -> tuple[dict[int, str], dict[str, str | None]]:
+    # See load_marks(), the modification time and size of the file are part of the cache key
+    marks = {}
+    fills = {}
+    with open(file_name, encoding="utf-8-sig", newline="") as f:
+        entries = iter_ics_marks(f) if file_name.lower().endswith(".ics") else iter_csv_marks(f)
+        try:
+            for line, first, last, category, fill in entries:
+                if last < first:
+                    raise ValueError(f"line {line}: end is before start")
+                if fill is not None and not re.fullmatch(r"[0-9a-fA-F]{6}", fill):
+                    raise ValueError(f"line {line}: fill should be an RGB color like 'D9D9D9'")
+                if fills.get(category) is None:
+                    fills[category] = fill.upper() if fill else None
+                if first == last:
+                    marks[first] = category
+                else:
+                    marks.update(dict.fromkeys(range(first, last + 1), category))
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_name)}, {e}") from None
+    return marks, fills
+
+
+def iter_csv_marks(f: TextIO) -> Iterator[tuple[int, int, int, str, str | None]]:
+    # Yields (line, first ordinal, last ordinal, category, fill) for every row of a CSV mark file
+    import csv
+    reader = csv.reader(f)
+    header = [column.strip().lower() for column in next(reader, [])]
+    start_column = header.index("start") if "start" in header else header.index("date") if "date" in header else None
+    if start_column is None or "category" not in header:
+        raise ValueError("line 1: header should have the columns 'start' (or 'date') and 'category'")
+    end_column = header.index("end") if "end" in header else None
+    category_column = header.index("category")
+    fill_column = header.index("fill") if "fill" in header else None
+    fromisoformat = datetime.date.fromisoformat
+    for line, row in enumerate(reader, 2):
+        if not row:
+            continue
+        try:
+            first = fromisoformat(row[start_column].strip()).toordinal()
+            end = row[end_column].strip() if end_column is not None and end_column < len(row) else ""
+            last = fromisoformat(end).toordinal() if end else first
+            fill = row[fill_column].strip() if fill_column is not None and fill_column < len(row) else ""
+            yield line, first, last, row[category_column].strip(), fill or None
+        except IndexError:
+            raise ValueError(f"line {line}: missing columns") from None
+        except ValueError as e:
+            raise ValueError(f"line {line}: {e}") from None
+
+
+def iter_ics_marks(f: TextIO) -> Iterator[tuple[int, int, int, str, None]]:
+    # Yields (line, first ordinal, last ordinal, category, None) for every event of an ICS file
+    # Only the dates of DTSTART and DTEND are used; recurrence rules are not expanded.
+    event = None
+    logical_line = ""
+    for line, text in enumerate(f, 1):
+        text = text.rstrip("\r\n")
+        # Folded lines continue the previous line
+        if text[:1] in (" ", "\t"):
+            logical_line += text[1:]
+            continue
+        if logical_line:
+            name, _, value = logical_line.partition(":")
+            name, _, params = name.partition(";")
+            name = name.upper()
+            if name == "BEGIN" and value.upper() == "VEVENT":
+                event = {"line": line - 1}
+            elif event is not None:
+                if name == "END" and value.upper() == "VEVENT":
+                    yield get_ics_mark(event)
+                    event = None
+                elif name in ("DTSTART", "DTEND", "SUMMARY", "CATEGORIES"):
+                    event[name] = (value, params.upper())
+        logical_line = text
+    if logical_line.upper() == "END:VEVENT" and event is not None:
+        yield get_ics_mark(event)
+
+
+def get_ics_mark(event: dict) -> tuple[int, int, int, str, None]:
+    # Returns the mark of a parsed ICS event
+    if "DTSTART" not in event:
+        raise ValueError(f"line {event['line']}: event without DTSTART")
+    try:
+        start, start_params = event["DTSTART"]
+        first = datetime.date(int(start[:4]), int(start[4:6]), int(start[6:8])).toordinal()
+        last = first
+        if "DTEND" in event:
+            end, end_params = event["DTEND"]
+            last = datetime.date(int(end[:4]), int(end[4:6]), int(end[6:8])).toordinal()
+            # The end of an all-day event, or an event ending at midnight, is exclusive
+            if len(end) <= 8 or "VALUE=DATE" in end_params or end[9:15] == "000000":
+                last = max(last - 1, first)
+    except ValueError:
+        raise ValueError(f"line {event['line']}: invalid event date") from None
+    if "CATEGORIES" in event:
+        category = event["CATEGORIES"][0].split(",")[0]
     else:
-        while current_day <= last_day:
-            day_list.append([current_day, *get_week_info(current_day), 0])
-            current_day += td
-
-    # Add padding days to get full start and end weeks
-    # Front padding
-    while day_list[0][2] != 1:
-        current_day = day_list[0][0] - datetime.timedelta(days=1)
-        if opt['NL_HOLIDAYS']:
-            if current_day in holidays:
-                day_list.insert(0, [current_day, *get_week_info(current_day), 1])
+        category = event.get("SUMMARY", ("Marked", ""))[0]
+    return event["line"], first, last, category.replace("\\,", ",").replace("\\;", ";").strip(), None
+
+
+def get_marks(file_names: Sequence[str]) -> dict[int, str]:
+    # Returns the fill of every day marked by the given mark files by ordinal
+    # Later files win where marks overlap. Categories without a fill of their own get the next mark fill.
+    marks = {}
+    category_fills = {}
+    for file_name in file_names:
+        file_marks, fills = load_marks(file_name)
+        for category, fill in fills.items():
+            if fill:
+                category_fills[category] = fill
+            elif category not in category_fills:
+                category_fills[category] = mark_fills[len(category_fills) % len(mark_fills)]
+        marks.update(file_marks)
+    return {o: category_fills[category] for o, category in marks.items()}
+
+
+def get_month_length(year: int, month: int) -> int:
+    # Returns the number of days in the given month
+    if month == 2:
+        return 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
+
+
+def get_new_year_ordinal(year: int) -> int:
+    # Returns the ordinal of January 1st of the given year, also for years outside the datetime range
+    y = year - 1
+    return y * 365 + y // 4 - y // 100 + y // 400 + 1
+
+
+class DayGrid:
+    # Compact columnar day grid of a timespan, padded to full Monday-to-Sunday weeks
+    # Only what can't be derived from the position of a day is stored: day i of the grid is found at day[i] and
+    # holiday[i], week w (the positions 7 * w up to and including 7 * w + 6) at week[w] and month[w], the month of
+    # its Monday. The ordinal of day i is ordinal[i], a range, and its ISO weekday is i % 7 + 1. Holidays are given as
+    # layers of ordinal sets and holiday[i] is the number of the first layer holding day i, counting from 1, or 0 for
+    # no holiday. The grid takes about 2.3 bytes per day and no objects per day or week.
+    __slots__ = ("ordinal", "day", "holiday", "week", "month")
+
+    def __init__(self, first_day: datetime.date, last_day: datetime.date,
+                 holidays: Sequence[frozenset[int]] | frozenset[int] = ()) -> None:
+        # Pad to the Monday on or before the first day and the Sunday on or after the last day
+        start = first_day.toordinal() - first_day.isoweekday() + 1
+        end = last_day.toordinal() + 7 - last_day.isoweekday()
+        length = end - start + 1
+        self.ordinal = range(start, end + 1)
+
+        # Day-of-month, filled one month segment at a time, and the month of every Monday
+        self.day = array("b")
+        self.month = array("b")
+        padded_first_day = datetime.date.fromordinal(start)
+        year, month, day = padded_first_day.year, padded_first_day.month, padded_first_day.day
+        position = 0
+        while position < length:
+            count = min(get_month_length(year, month) - day + 1, length - position)
+            self.day.extend(range(day, day + count))
+            # Mondays are the positions divisible by 7
+            self.month.extend(array("b", [month]) * ((position + count + 6) // 7 - (position + 6) // 7))
+            position += count
+            day = 1
+            month += 1
+            if month == 13:
+                year, month = year + 1, 1
+
+        # ISO weeks: a week belongs to the year its Thursday falls in
+        self.week = array("b")
+        year = padded_first_day.year
+        new_year = get_new_year_ordinal(year)
+        next_new_year = get_new_year_ordinal(year + 1)
+        for monday in range(start, end + 1, 7):
+            thursday = monday + 3
+            if thursday >= next_new_year:
+                year += 1
+                new_year, next_new_year = next_new_year, get_new_year_ordinal(year + 1)
+            self.week.append((thursday - new_year) // 7 + 1)
+
+        # Holiday layers, set from the holiday indexes instead of testing every day. Lower layers are set last so
+        # they win where layers overlap.
+        if isinstance(holidays, (set, frozenset)):
+            holidays = (holidays,)
+        self.holiday = array("b", bytes(length))
+        for layer in range(len(holidays), 0, -1):
+            for o in holidays[layer - 1]:
+                if start <= o <= end:
+                    self.holiday[o - start] = layer
+
+    def __len__(self) -> int:
+        return len(self.ordinal)
+
+    def iter_weekday(self, weekday: int) -> Iterator[tuple[int, int, int]]:
+        # Yields (position, ordinal, day) of every day of the grid on the given ISO weekday, in order
+        ordinals = self.ordinal[weekday - 1::7]
+        return zip(range(weekday - 1, len(self), 7), ordinals, self.day[weekday - 1::7])
+
+    def nbytes(self) -> int:
+        # Returns the memory taken by the grid and its columns in bytes
+        return (sys.getsizeof(self) + sys.getsizeof(self.ordinal)
+                + sum(sys.getsizeof(column) for column in (self.day, self.holiday, self.week, self.month)))
+
+
+class CalendarIndex:
+    # Working-day index over whole years, built on the same weekend and holiday model as the calendars
+    # A prefix-sum array holds the number of working days before every day of the indexed range, so working days
+    # between two dates are counted in O(1) and business-day offsets are found in O(log n) with bisect. Queries
+    # outside the indexed years extend the index, at least doubling it so extensions are rare.
+    __slots__ = ("holidays", "weekend", "table")
+
+    def __init__(self, year_start: int, year_end: int, holidays: Sequence[str] = (),
+                 weekend: Sequence[int] = (6, 7)) -> None:
+        for name in holidays:
+            if name not in holiday_sets:
+                raise ValueError(f"Unknown holiday set: {name}")
+        self.holidays = tuple(holidays)
+        self.weekend = tuple(weekend)
+        self.build(year_start, year_end)
+
+    @classmethod
+    def from_spec(cls, spec: "CalendarSpec") -> "CalendarIndex":
+        # Returns an index of the years and holiday sets of the spec
+        return cls(spec.year_start, spec.year_end, spec.holidays)
+
+    def build(self, year_start: int, year_end: int) -> tuple[int, array]:
+        # (Re)builds the index over the given years and returns its table
+        if not 1 <= year_start <= year_end <= 9999:
+            raise ValueError("Years should be numbers from 1 to 9999.")
+        start = get_new_year_ordinal(year_start)
+        length = get_new_year_ordinal(year_end + 1) - start
+
+        # Working day flags: the weekly pattern rotated to the first day, then the holidays cleared
+        week = bytes(0 if weekday in self.weekend else 1 for weekday in range(1, 8))
+        shift = (start - 1) % 7
+        working = bytearray((week[shift:] + week[:shift]) * (length // 7 + 1))[:length]
+        for layer in get_holiday_layers(start, start + length - 1, self.holidays):
+            for o in layer:
+                if start <= o < start + length:
+                    working[o - start] = 0
+
+        # Replaced as a whole, so concurrent queries see either the old or the new index
+        table = (start, array("i", accumulate(working, initial=0)))
+        self.table = table
+        return table
+
+    def lookup(self, ordinal: int) -> tuple[int, array]:
+        # Returns the table with the given ordinal inside the indexed range, extending the index if needed
+        return self.lookup_range(ordinal, ordinal)
+
+    def lookup_range(self, first: int, last: int) -> tuple[int, array]:
+        # Returns a single table with the ordinals from first to last inside the indexed range, extending the index if
+        # needed. Queries index this one table only, as another thread may replace the index in between.
+        start, counts = self.table
+        if start <= first and last < start + len(counts) - 1:
+            return start, counts
+        if not 1 <= first <= last <= datetime.date.max.toordinal():
+            raise ValueError("Date is outside the years 1 to 9999.")
+        year_start = datetime.date.fromordinal(start).year
+        year_end = datetime.date.fromordinal(start + len(counts) - 2).year
+        span = year_end - year_start + 1
+        first_year = datetime.date.fromordinal(first).year
+        last_year = datetime.date.fromordinal(last).year
+        return self.build(max(min(first_year, year_start - span), 1), min(max(last_year, year_end + span), 9999))
+
+    def is_working_day(self, date: datetime.date) -> bool:
+        o = date.toordinal()
+        start, counts = self.lookup(o)
+        return counts[o - start + 1] != counts[o - start]
+
+    def count_working_days(self, first_day: datetime.date, end_day: datetime.date) -> int:
+        # Returns the number of working days from first_day up to but not including end_day, negative if end_day
+        # comes before first_day
+        first, end = first_day.toordinal(), end_day.toordinal()
+        if first == end:
+            return 0
+        start, counts = self.lookup_range(min(first, end), max(first, end) - 1)
+        return counts[end - start] - counts[first - start]
+
+    def add_working_days(self, date: datetime.date, days: int) -> datetime.date:
+        # Returns the working day <days> working days after the date, or before it for negative days. The date
+        # itself is not counted, so it does not have to be a working day. Zero days returns the date.
+        if days == 0:
+            return date
+        o = date.toordinal()
+        start, counts = self.lookup(o)
+        while True:
+            if days > 0:
+                # The first day j where the working days up to and including j reach the target
+                target = counts[o - start + 1] + days
+                if target <= counts[-1]:
+                    return datetime.date.fromordinal(start + bisect_left(counts, target) - 1)
+                start, counts = self.lookup(start + len(counts) - 1)
             else:
-                day_list.insert(0, [current_day, *get_week_info(current_day), 0])
-        else:
-            day_list.insert(0, [current_day, *get_week_info(current_day), 0])
-    # Back padding
-    while day_list[-1][2] != 7:
-        current_day = day_list[-1][0] + datetime.timedelta(days=1)
-        if opt['NL_HOLIDAYS']:
-            if current_day in holidays:
-                day_list.append([current_day, *get_week_info(current_day), 1])
+                # The last day j with exactly the target working days before it that is a working day itself
+                target = counts[o - start] + days
+                if target >= 0:
+                    return datetime.date.fromordinal(start + bisect_left(counts, target + 1) - 1)
+                start, counts = self.lookup(start - 1)
+
+    def is_working_day_many(self, dates: Iterable[datetime.date]) -> list[bool]:
+        # Bulk version of is_working_day()
+        ordinals = [date.toordinal() for date in dates]
+        if not ordinals:
+            return []
+        start, counts = self.lookup_range(min(ordinals), max(ordinals))
+        return [counts[o - start + 1] != counts[o - start] for o in ordinals]
+
+    def count_working_days_many(self, first_days: Iterable[datetime.date],
+                                end_days: Iterable[datetime.date]) -> list[int]:
+        # Bulk version of count_working_days() over pairs of first and end days
+        firsts = [date.toordinal() for date in first_days]
+        ends = [date.toordinal() for date in end_days]
+        if len(firsts) != len(ends):
+            raise ValueError("first_days and end_days should be of the same length.")
+        if not firsts:
+            return []
+        # The last day counted is the day before the latest end, unless all pairs are empty
+        low = min(min(firsts), min(ends))
+        start, counts = self.lookup_range(low, max(max(firsts), max(ends) - 1, low))
+        return [counts[end - start] - counts[first - start] for first, end in zip(firsts, ends)]
+
+    def add_working_days_many(self, dates: Iterable[datetime.date], days: Iterable[int]) -> list[datetime.date]:
+        # Bulk version of add_working_days() over pairs of dates and day counts
+        return [self.add_working_days(date, n) for date, n in zip(dates, days, strict=True)]
+
+
+@lru_cache(maxsize=None)
+def get_font(key: str) -> "Font":
+    # Returns the openpyxl font template for the given key
+    from openpyxl.styles import Font
+    name, size, bold = font_dict[key]
+    return Font(name=name, size=size, bold=bold)
+
+
+@lru_cache(maxsize=None)
+def get_alignment(horizontal: str) -> "Alignment":
+    # Returns the openpyxl alignment template for the given horizontal alignment
+    from openpyxl.styles import Alignment
+    return Alignment(horizontal=horizontal, vertical="center")
+
+
+@lru_cache(maxsize=None)
+def get_fill(color: str) -> "PatternFill":
+    # Returns the openpyxl solid fill template for the given color
+    from openpyxl.styles import PatternFill
+    return PatternFill("solid", fgColor=color)
+
+
+@lru_cache(maxsize=None)
+def get_border(key: str) -> "Border":
+    # Returns the openpyxl border template for the given border key
+    from openpyxl.styles import Border, Side
+    return Border(**{border_sides[k.lower()]: Side(border_style="thin" if k.islower() else "medium", color="000000")
+                     for k in key})
+
+
+def column_letter(column: int) -> str:
+    # Returns the Excel column letter(s) of the given 1-based column number
+    letters = ""
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+class SheetLayout:
+    # Values, styles and merged ranges of all cells of a calendar sheet, computed ahead from the day grid
+    # Cells are (value, style) tuples, where style is a (font, alignment, fill, border) tuple of template keys
+    # and None means the default. Cells covered by a merged range only get the edge borders of their range,
+    # the same way openpyxl formats merged cells.
+    __slots__ = ("grid", "weekday_dict", "month_dict", "year", "holiday_fills", "marks", "last_column", "month_runs",
+                 "merges")
+
+    def __init__(self, grid: DayGrid, weekday_dict: dict[int, str], month_dict: dict[int, str], year: int,
+                 holiday_fills: tuple[str, ...] = (fill_mediumgrey,), marks: dict[int, str] | None = None) -> None:
+        self.grid = grid
+        self.weekday_dict = weekday_dict
+        self.month_dict = month_dict
+        self.year = year
+        # Fill of every holiday layer of the grid, and the fill of marked days by ordinal
+        self.holiday_fills = holiday_fills
+        self.marks = marks or {}
+        self.last_column = len(grid) // 7 + 2
+
+        # Runs of week columns whose Monday falls in the same month, as [start_column, end_column]
+        self.month_runs = []
+        for col in range(3, self.last_column + 1):
+            month = grid.month[col - 3]
+            if self.month_runs and grid.month[self.month_runs[-1][0] - 3] == month:
+                self.month_runs[-1][1] = col
             else:
-                day_list.append([current_day, *get_week_info(current_day), 0])
-        else:
-            day_list.append([current_day, *get_week_info(current_day), 0])
+                self.month_runs.append([col, col])
 
-    # Create an openpyxl worksheet
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"{opt['M_S']}-{opt['Y_S']} to {opt['M_E']}-{opt['Y_E']}"
-
-    # Write row header values and styles
-    # First year
-    c = ws.cell(row=1, column=1)
-    c.value = opt['Y_S']
-    c.font = font_bold
-    c.alignment = h_align_center
-    c.fill = fill_white
-    c.border = border_LrTb
-    # Short day names
-    for i in range(1, 8):
-        c = ws.cell(row=i + 1, column=1)
-        c.value = weekday_dict[i]
-        c.font = font_standard
-        c.alignment = h_align_right
-        c.fill = fill_white
-        c.border = border_Lr
-    # 'week' cell
-    c = ws.cell(row=9, column=1)
-    # c.value = weekday_dict[8]
-    c.font = font_standard
-    c.alignment = h_align_right
-    c.fill = fill_white
-    c.border = border_LrtB
-    # Merge the row header cells
-    for i in range(1, 10):
-        ws.merge_cells(start_row=i, start_column=1, end_row=i, end_column=2)
-
-    # Get some limits for further filling and styling the sheet
-    len_day_list = len(day_list)
-    last_column = int(len_day_list / 7 + 2)
-
-    # Write all month headers + day- and weeknumbers from the list of days to the worksheet
-    day_index = 0
-    for col in range(3, last_column + 1):
-        if day_index == len_day_list:
-            break
-        # Write month column header
-        c = ws.cell(row=1, column=col)
-        c.value = month_dict[day_list[day_index][0].month]
-        c.font = font_bold
-        c.alignment = h_align_center
-        c.fill = fill_white
-
-        # Write day- and weeknumber
-        for row in range(1, 8):
-            if day_list[day_index][2] == row:
-                # days
-                c = ws.cell(row=row + 1, column=col)
-                c.value = day_list[day_index][0].day
-                c.font = font_standard
-                c.alignment = h_align_center
-                # Fill mediumgrey for holidays, lightgrey for weekends, white for normal days
-                if opt['NL_HOLIDAYS']:
-                    if day_list[day_index][0] in holidays:
-                        c.fill = fill_mediumgrey
-                    elif day_list[day_index][2] == 6 or day_list[day_index][2] == 7:
-                        c.fill = fill_lightgrey
+        # Merged ranges as (start_row, start_column, end_row, end_column)
+        self.merges = [(row, 1, row, 2) for row in range(1, 10)]
+        self.merges.extend((1, start, 1, end) for start, end in self.month_runs)
+
+    def iter_row(self, row: int) -> Iterator[tuple[object, tuple]]:
+        # Yields the cells of the given sheet row, from column 1 up to and including the last column
+        grid = self.grid
+        marks = self.marks
+        last_week = len(grid) - 7
+        if row == 1:
+            # First year + month headers
+            yield self.year, ("bold", h_align_center, fill_white, "LrTb")
+            yield None, (None, None, None, "rTb")
+            last_run = len(self.month_runs) - 1
+            for i, (start, end) in enumerate(self.month_runs):
+                # A single padding week at the start has no room for the month name
+                value = None if start == end == 3 else self.month_dict[grid.month[start - 3]]
+                yield value, ("bold", h_align_center, fill_white, "lRTb" if i == last_run else "lrTb")
+                for col in range(start + 1, end + 1):
+                    if col < end:
+                        yield None, (None, None, None, "Tb")
                     else:
-                        c.fill = fill_white
+                        yield None, (None, None, None, "RTb" if i == last_run else "rTb")
+        elif row <= 8:
+            # Short day name + daynumbers
+            yield self.weekday_dict[row - 1], ("standard", h_align_right, fill_white, "Lr")
+            yield None, (None, None, None, "r")
+            weekend_fill = fill_lightgrey if row >= 7 else fill_white
+            for day_index, o, day in grid.iter_weekday(row - 1):
+                # Fill marked days with the fill of their category, holidays with the fill of their layer,
+                # lightgrey for weekends, white for normal days
+                if marks and o in marks:
+                    fill = marks[o]
+                elif grid.holiday[day_index]:
+                    fill = self.holiday_fills[grid.holiday[day_index] - 1]
                 else:
-                    if day_list[day_index][2] == 6 or day_list[day_index][2] == 7:
-                        c.fill = fill_lightgrey
-                    else:
-                        c.fill = fill_white
-
-                # weeks
-                c = ws.cell(row=9, column=col)
-                c.value = day_list[day_index][1]
-                c.font = font_standard
-                c.alignment = h_align_center
-                c.fill = fill_white
-
-                day_index += 1
-                if day_index == len_day_list:
-                    break
-            else:
-                c = ws.cell(row=row + 1, column=col)
-                c.font = font_standard
-                c.alignment = h_align_center
-                c.fill = fill_white
-
-    # Merge header cells of corresponding months and set border styles
-    prev_cell_content = ws.cell(row=1, column=3).value
-    merge_range_start = 3
-    merge_range_end = 3
-    ws.cell(row=1, column=3).border = border_lrTb
-    for col in range(4, last_column + 2):
-        if ws.cell(row=1, column=col).value == prev_cell_content:
-            merge_range_end = col
+                    fill = weekend_fill
+                # Outline the first week of every month, close the sheet with a medium right border
+                if day == 1:
+                    border = "lRt" if day_index >= last_week else "lt"
+                elif day <= 7:
+                    border = "lR" if day_index >= last_week else "l"
+                else:
+                    border = "R" if day_index >= last_week else None
+                yield day, ("standard", h_align_center, fill, border)
         else:
-            if col == last_column + 1:
-                ws.cell(row=1, column=merge_range_start).border = border_lRTb
-                ws.merge_cells(start_row=1, start_column=merge_range_start, end_row=1, end_column=merge_range_end)
+            # 'week' cell + weeknumbers
+            yield None, ("standard", h_align_right, fill_white, "LrtB")
+            yield None, (None, None, None, "rtB")
+            for w, week in enumerate(grid.week):
+                yield week, ("standard", h_align_center, fill_white, "lRtB" if 7 * w == last_week else "lrtB")
+
+    def styles(self) -> list[tuple]:
+        # Returns every style this layout can give a cell, in a fixed order
+        return get_layout_styles(self.holiday_fills, self.marks)
+
+
+def get_layout_styles(holiday_fills: tuple[str, ...], marks: dict[int, str]) -> list[tuple]:
+    # Returns every style a layout with the given holiday fills and marks can give a cell, in a fixed order
+    # The styles do not depend on the days of a layout, so all bands of a calendar share them.
+    styles = [("bold", h_align_center, fill_white, border) for border in ("LrTb", "lrTb", "lRTb")]
+    styles.extend((None, None, None, border) for border in ("rTb", "Tb", "RTb", "r", "rtB"))
+    styles.extend(("standard", h_align_right, fill_white, border) for border in ("Lr", "LrtB"))
+    styles.extend(("standard", h_align_center, fill, border)
+                  for fill in dict.fromkeys((fill_white, fill_lightgrey, *holiday_fills, *sorted(set(marks.values()))))
+                  for border in (None, "lt", "l", "lRt", "lR", "R"))
+    styles.extend(("standard", h_align_center, fill_white, border) for border in ("lrtB", "lRtB"))
+    return styles
+
+
+
+# Available renderers
+renderers = ("std", "lowmem", "native")
+
+
+class CalendarSpecFields(NamedTuple):
+    # Fields and defaults of CalendarSpec
+    year_start: int
+    month_start: int
+    year_end: int
+    month_end: int
+    column_width: float = 3.5
+    row_height: float = 12.7
+    lang: str | None = None
+    holidays: tuple[str, ...] = ()
+    renderer: str = "std"
+    marks: tuple[str, ...] = ()
+    band: int | str | None = None
+    band_sheets: bool = False
+    compress_level: int | None = None
+
+
+class CalendarSpec(CalendarSpecFields):
+    # Everything a calendar is rendered from
+    # Specs are immutable and rendering one touches no global state, so render() and render_to() can be called
+    # from several threads at once. (A named tuple rather than a frozen dataclass, which would import dataclasses and
+    # inspect on every start of the command line tool.)
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs) -> "CalendarSpec":
+        self = super().__new__(cls, *args, **kwargs)
+        if not (1 <= self.month_start <= 12 and 1 <= self.month_end <= 12):
+            raise ValueError("Months should be numbers from 1 to 12.")
+        if not (1 <= self.year_start <= 9999 and 1 <= self.year_end <= 9999):
+            raise ValueError("Years should be numbers from 1 to 9999.")
+        if (self.year_end, self.month_end) < (self.year_start, self.month_start):
+            raise ValueError("End date is earlier than start date.")
+        if not (isfinite(self.column_width) and isfinite(self.row_height)
+                and self.column_width > 0 and self.row_height > 0):
+            raise ValueError("Column width and row height should be finite numbers > 0.")
+        if self.lang is not None and self.lang not in get_locale_catalog():
+            raise ValueError(f"Unsupported language: {self.lang}")
+        for name in self.holidays:
+            if name not in holiday_sets:
+                raise ValueError(f"Unknown holiday set: {name}")
+        if self.renderer not in renderers:
+            raise ValueError(f"Unknown renderer: {self.renderer}")
+        if isinstance(self.marks, str) or not all(isinstance(file_name, str) for file_name in self.marks):
+            raise ValueError("Marks should be a tuple of file names.")
+        if not (self.band in (None, "year")
+                or type(self.band) is int and 1 <= self.band <= max_band_weeks):
+            raise ValueError(f"Band should be 'year' or a number of weeks from 1 to {max_band_weeks}.")
+        if self.band is None:
+            # Without bands all weeks, padded to whole Monday-to-Sunday weeks, share one row of the sheet. Ordinal 1
+            # is a Monday, so ordinal o falls in week (o - 1) // 7.
+            first = datetime.date(self.year_start, self.month_start, 1).toordinal()
+            last = datetime.date(self.year_end, self.month_end,
+                                 get_month_length(self.year_end, self.month_end)).toordinal()
+            if (last - 1) // 7 - (first - 1) // 7 + 1 > max_band_weeks:
+                raise ValueError(f"Calendars without bands can't span more than {max_band_weeks} weeks, split them "
+                                 f"into bands.")
+        if not (self.compress_level is None or type(self.compress_level) is int and 0 <= self.compress_level <= 9):
+            raise ValueError("Compression level should be a number from 0 to 9.")
+        return self
+
+    @classmethod
+    def _make(cls, iterable) -> "CalendarSpec":
+        # Also used by _replace(), so specs made from other values are validated like new ones
+        return cls(*iterable)
+
+    @property
+    def title(self) -> str:
+        return f"{self.month_start}-{self.year_start} to {self.month_end}-{self.year_end}"
+
+
+# Bands
+# A calendar can be split into bands of a year or a number of weeks, each laid out as a calendar of its own with its
+# own year header. Bands are stacked on one sheet, every band taking band_rows rows (its 9 rows and an empty row), or
+# put on sheets of their own. A band is described by a few numbers, so the layout of a band can be built on its own,
+# in any order or process, and only the bands being written have to be in memory.
+max_band_weeks = 16384 - 2
+band_rows = 10
+
+
+class Band(NamedTuple):
+    # Weeks of a calendar laid out as one block: the 9 rows below row <row> of sheet number <sheet>
+    year: int
+    first_monday: int
+    weeks: int
+    sheet: int = 0
+    row: int = 0
+
+    @property
+    def last_column(self) -> int:
+        return self.weeks + 2
+
+
+def get_padded_weeks(spec: CalendarSpec) -> tuple[int, int]:
+    # Returns the ordinals of the first Monday and the last Sunday of the calendar described by the spec
+    first_day = datetime.date(spec.year_start, spec.month_start, 1)
+    last_day = datetime.date(spec.year_end, spec.month_end, get_month_length(spec.year_end, spec.month_end))
+    return first_day.toordinal() - first_day.isoweekday() + 1, last_day.toordinal() + 7 - last_day.isoweekday()
+
+
+def get_band_year(first_monday: int) -> int:
+    # Returns the year of the band starting at the given Monday, the year its first Sunday falls in
+    # The Sunday of the last week of 9999 falls past the datetime range, that week belongs to 9999.
+    return datetime.date.fromordinal(min(first_monday + 6, datetime.date.max.toordinal())).year
+
+
+def iter_bands(spec: CalendarSpec) -> Iterator[Band]:
+    # Yields the bands of the calendar described by the spec in sheet and row order, a single band if it has none
+    start, end = get_padded_weeks(spec)
+
+    # Mondays at which a new band starts
+    if spec.band is None:
+        mondays = []
+    elif spec.band == "year":
+        # A week belongs to the year its Sunday falls in, so every year band starts with the week of its January 1st
+        # and the year header of the first band is the start year. Only the last band runs into the next year.
+        mondays = []
+        for year in range(spec.year_start + 1, spec.year_end + 1):
+            new_year = get_new_year_ordinal(year)
+            mondays.append(new_year - (new_year - 1) % 7)
+    else:
+        mondays = range(start + 7 * spec.band, end, 7 * spec.band)
+
+    for i, (first_monday, next_monday) in enumerate(zip(chain((start,), mondays), chain(mondays, (end + 1,)))):
+        year = get_band_year(first_monday)
+        if spec.band_sheets:
+            yield Band(year, first_monday, (next_monday - first_monday) // 7, i, 0)
+        else:
+            yield Band(year, first_monday, (next_monday - first_monday) // 7, 0, band_rows * i)
+
+
+def get_sheet_title(spec: CalendarSpec, band: Band) -> str:
+    # Returns the title of the sheet holding the band: the year or the ISO week of the first Monday of a band on a
+    # sheet of its own, else the title of the calendar
+    if not spec.band_sheets or spec.band is None:
+        return spec.title
+    if spec.band == "year":
+        return str(band.year)
+    iso_year, week, _ = datetime.date.fromordinal(band.first_monday).isocalendar()
+    return f"{iso_year}-W{week:02d}"
+
+
+def get_sheets(spec: CalendarSpec) -> list[tuple[str, int, int]]:
+    # Returns the title, last column and last row of every sheet of the calendar described by the spec
+    # Computed from the bands alone, so the sheet dimensions are known before any cell is written.
+    sheets = []
+    for band in iter_bands(spec):
+        if band.sheet == len(sheets):
+            sheets.append([get_sheet_title(spec, band), band.last_column, band.row + 9])
+        else:
+            sheets[-1][1] = max(sheets[-1][1], band.last_column)
+            sheets[-1][2] = band.row + 9
+    return [tuple(sheet) for sheet in sheets]
+
+
+# Locale catalog
+# The day and month names of every supported language as they appear in the sheets: weekday abbreviations from
+# Monday to Sunday and capitalized month names, with the English name of the language to recognize Windows locale
+# names like 'Dutch_Netherlands'. The table is parsed into LocaleNames on first use and never changes afterwards, so
+# calendars in any language can be rendered side by side from threads or processes, without switching or probing
+# the process-wide OS locale.
+locale_table = """
+en english      Mon Tue Wed Thu Fri Sat Sun
+    January February March April May June July August September October November December
+nl dutch        Ma Di Wo Do Vr Za Zo
+    Januari Februari Maart April Mei Juni Juli Augustus September Oktober November December
+fr french       Lun Mar Mer Jeu Ven Sam Dim
+    Janvier Février Mars Avril Mai Juin Juillet Août Septembre Octobre Novembre Décembre
+de german       Mo Di Mi Do Fr Sa So
+    Januar Februar März April Mai Juni Juli August September Oktober November Dezember
+es spanish      Lun Mar Mié Jue Vie Sáb Dom
+    Enero Febrero Marzo Abril Mayo Junio Julio Agosto Septiembre Octubre Noviembre Diciembre
+it italian      Lun Mar Mer Gio Ven Sab Dom
+    Gennaio Febbraio Marzo Aprile Maggio Giugno Luglio Agosto Settembre Ottobre Novembre Dicembre
+pt portuguese   Seg Ter Qua Qui Sex Sáb Dom
+    Janeiro Fevereiro Março Abril Maio Junho Julho Agosto Setembro Outubro Novembro Dezembro
+da danish       Man Tir Ons Tor Fre Lør Søn
+    Januar Februar Marts April Maj Juni Juli August September Oktober November December
+nb norwegian    Man Tir Ons Tor Fre Lør Søn
+    Januar Februar Mars April Mai Juni Juli August September Oktober November Desember
+sv swedish      Mån Tis Ons Tor Fre Lör Sön
+    Januari Februari Mars April Maj Juni Juli Augusti September Oktober November December
+fi finnish      Ma Ti Ke To Pe La Su
+    Tammikuu Helmikuu Maaliskuu Huhtikuu Toukokuu Kesäkuu Heinäkuu Elokuu Syyskuu Lokakuu Marraskuu Joulukuu
+pl polish       Pon Wt Śr Czw Pt Sob Ndz
+    Styczeń Luty Marzec Kwiecień Maj Czerwiec Lipiec Sierpień Wrzesień Październik Listopad Grudzień
+cs czech        Po Út St Čt Pá So Ne
+    Leden Únor Březen Duben Květen Červen Červenec Srpen Září Říjen Listopad Prosinec
+hu hungarian    H K Sze Cs P Szo V
+    Január Február Március Április Május Június Július Augusztus Szeptember Október November December
+ro romanian     Lun Mar Mie Joi Vin Sâm Dum
+    Ianuarie Februarie Martie Aprilie Mai Iunie Iulie August Septembrie Octombrie Noiembrie Decembrie
+tr turkish      Pzt Sal Çar Per Cum Cmt Paz
+    Ocak Şubat Mart Nisan Mayıs Haziran Temmuz Ağustos Eylül Ekim Kasım Aralık
+el greek        Δευ Τρί Τετ Πέμ Παρ Σάβ Κυρ
+    Ιανουάριος Φεβρουάριος Μάρτιος Απρίλιος Μάιος Ιούνιος Ιούλιος Αύγουστος Σεπτέμβριος Οκτώβριος Νοέμβριος Δεκέμβριος
+ru russian      Пн Вт Ср Чт Пт Сб Вс
+    Январь Февраль Март Апрель Май Июнь Июль Август Сентябрь Октябрь Ноябрь Декабрь
+id indonesian   Sen Sel Rab Kam Jum Sab Min
+    Januari Februari Maret April Mei Juni Juli Agustus September Oktober November Desember
+"""
+
+
+class LocaleNames(NamedTuple):
+    # The day and month names of a language in the locale catalog
+    name: str
+    weekdays: tuple[str, ...]
+    months: tuple[str, ...]
+
+
+@lru_cache(maxsize=None)
+def get_locale_catalog() -> dict[str, LocaleNames]:
+    # Returns the locale catalog by language code, parsed from the locale table once
+    catalog = {}
+    lines = locale_table.strip().splitlines()
+    for header, months in zip(lines[::2], lines[1::2]):
+        lang, name, *weekdays = header.split()
+        catalog[lang] = LocaleNames(name, tuple(weekdays), tuple(months.split()))
+    return catalog
+
+
+@lru_cache(maxsize=None)
+def get_default_lang() -> str:
+    # Returns the language of the OS locale, or English if the catalog does not have it
+    # The locale is only read, from the environment like the C library does or else from Python's startup locale.
+    import locale
+    locale_name = next((os.environ[key] for key in ("LC_ALL", "LC_TIME", "LANG") if os.environ.get(key)), None)
+    language = re.split(r"[_.@ -]", (locale_name or locale.getlocale()[0] or "").lower())[0]
+    for lang, names in get_locale_catalog().items():
+        if language in (lang, names.name):
+            return lang
+    return "en"
+
+
+def get_names(lang: str | None) -> tuple[dict[int, str], dict[int, str]]:
+    # Returns the localized day and month names, numbered from 1, of the language or of the OS locale for None
+    names = get_locale_catalog()[lang or get_default_lang()]
+    return dict(enumerate(names.weekdays, 1)), dict(enumerate(names.months, 1))
+
+
+def get_layout(spec: CalendarSpec, profile: "Profile | None" = None, band: Band | None = None,
+               marks: dict[int, str] | None = None) -> SheetLayout:
+    # Returns the sheet layout of the calendar described by the spec as a whole, or of one of its bands
+    # Bands laid out one after the other can share the marks of the spec, so the mark files are expanded once.
+    weekday_dict, month_dict = get_names(spec.lang)
+    if band is None:
+        # The whole calendar as one band, also when the spec splits it into bands
+        start, end = get_padded_weeks(spec)
+        band = Band(get_band_year(start), start, (end + 1 - start) // 7)
+    first_day = datetime.date.fromordinal(band.first_monday)
+    last_day = datetime.date.fromordinal(min(band.first_monday + 7 * band.weeks - 1, datetime.date.max.toordinal()))
+
+    # Gather a holiday index per holiday set for marking
+    holidays = get_holiday_layers(band.first_monday, band.first_monday + 7 * band.weeks - 1, spec.holidays)
+    if profile:
+        profile.lap("holidays")
+
+    # Get the day grid for the weeks of the band
+    grid = DayGrid(first_day, last_day, holidays)
+    if profile:
+        profile.lap("day_grid")
+
+    # Expand the marked dates into a map from ordinal to fill
+    if marks is None:
+        marks = get_marks(spec.marks)
+    if profile:
+        profile.lap("marks")
+
+    layout = SheetLayout(grid, weekday_dict, month_dict, band.year,
+                         tuple(holiday_sets[name].fill for name in spec.holidays), marks)
+    if profile:
+        profile.lap("layout")
+    return layout
+
+
+def iter_layouts(spec: CalendarSpec, profile: "Profile | None" = None) -> Iterator[tuple[Band, SheetLayout]]:
+    # Yields every band of the calendar described by the spec with its layout, laid out one band at a time
+    # When profiled, the counts of every band are recorded as it is laid out
+    marks = get_marks(spec.marks)
+    if profile:
+        profile.lap("marks")
+    for band in iter_bands(spec):
+        layout = get_layout(spec, profile, band, marks)
+        if profile:
+            profile.count_layout(layout)
+            profile.lap("counts")
+        yield band, layout
+
+
+def render_to(spec: CalendarSpec, stream: BinaryIO, profile: "Profile | None" = None, workers: int = 1) -> None:
+    # Renders the calendar described by the spec as an XLSX file into the given binary file-like object, which
+    # doesn't have to be seekable
+    # When a profile is given, the phases of the render and its counts are recorded in it. The native renderer
+    # renders the bands of a calendar with the given number of worker processes.
+    if profile:
+        profile.start()
+        # Streams that can't tell their position, like pipes, have their bytes counted on the way through
+        if not stream.seekable():
+            stream = OutputCounter(stream)
+        start_position = stream.tell()
+    try:
+        if spec.renderer == "native":
+            write_native_workbook(spec, stream, profile, workers)
+            if profile:
+                profile.lap("write")
+        else:
+            if spec.renderer == "lowmem":
+                wb = build_write_only_workbook(spec, profile)
             else:
-                ws.cell(row=1, column=col).border = border_lrTb
-                ws.merge_cells(start_row=1, start_column=merge_range_start, end_row=1, end_column=merge_range_end)
-                prev_cell_content = ws.cell(row=1, column=col).value
-                if merge_range_start == 3 and merge_range_end == 3:
-                    ws.cell(row=1, column=3).value = None
-                merge_range_start = col
-
-    # Apply column width and row height
-    for i in range(1, last_column + 1):
-        ws.column_dimensions[get_column_letter(i)].width = opt['COLUMN_WIDTH']
-    for i in range(1, 10):
-        ws.row_dimensions[i].height = opt['ROW_HEIGHT']
-
-    # Apply borders to daynumber grid
-    for col in range(3, last_column):
-        for row in range(2, 9):
-            c = ws.cell(row=row, column=col)
-            if c.value == 1:
-                c.border = border_lt
-            elif 2 <= ws.cell(row=row, column=col).value <= 7:
-                c.border = border_l
-    for row in range(2, 9):
-        c = ws.cell(row=row, column=last_column)
-        if c.value == 1:
-            c.border = border_lRt
-        elif 2 <= c.value <= 7:
-            c.border = border_lR
+                wb = build_workbook(spec, profile)
+            save_workbook(wb, stream, spec.compress_level)
+            if profile:
+                profile.lap("save")
+    finally:
+        if profile:
+            profile.stop()
+
+    if profile:
+        profile.counts["bytes"] = stream.tell() - start_position
+
+
+def render(spec: CalendarSpec, profile: "Profile | None" = None, workers: int = 1) -> bytes:
+    # Returns the calendar described by the spec as the bytes of an XLSX file
+    stream = io.BytesIO()
+    render_to(spec, stream, profile, workers)
+    return stream.getvalue()
+
+
+class Profile:
+    # Per-phase wall and CPU times and counts of a render, recorded when passed to render() or render_to()
+    # Phases are laps: lap() closes the phase that ran since the previous lap. The renderers only test for a profile
+    # between phases, so rendering without one costs nothing extra. With cprofile set the render also runs under
+    # cProfile, see dump_stats().
+    __slots__ = ("phases", "counts", "styles", "profiler", "wall", "cpu")
+
+    def __init__(self, cprofile: bool = False) -> None:
+        self.phases = {}
+        self.counts = {}
+        self.styles = set()
+        self.profiler = None
+        if cprofile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.wall = self.cpu = 0.0
+
+    def start(self) -> None:
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if self.profiler:
+            self.profiler.enable()
+
+    def lap(self, phase: str) -> None:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        times = self.phases.setdefault(phase, {"wall": 0.0, "cpu": 0.0})
+        times["wall"] += wall - self.wall
+        times["cpu"] += cpu - self.cpu
+        self.wall, self.cpu = wall, cpu
+
+    def stop(self) -> None:
+        if self.profiler:
+            self.profiler.disable()
+
+    def count_layout(self, layout: SheetLayout) -> None:
+        # Adds the cells, merges and distinct cell styles of a laid out band to the counts
+        counts = self.counts
+        counts["cells"] = counts.get("cells", 0) + 9 * layout.last_column
+        counts["merges"] = counts.get("merges", 0) + len(layout.merges)
+        self.styles.update(style for row in range(1, 10) for _, style in layout.iter_row(row))
+        counts["styles"] = len(self.styles)
+        counts["bands"] = counts.get("bands", 0) + 1
+
+    def add_counts(self, other: "Profile") -> None:
+        # Adds the counts of bands laid out under another profile, such as in a band worker process
+        counts = self.counts
+        for key in ("cells", "merges"):
+            counts[key] = counts.get(key, 0) + other.counts.get(key, 0)
+        self.styles |= other.styles
+        counts["styles"] = len(self.styles)
+        counts["bands"] = counts.get("bands", 0) + other.counts.get("bands", 0)
+
+    def report(self) -> dict:
+        # Returns the recorded phases and counts with the totals, ready to be dumped as JSON
+        return {"phases": self.phases,
+                "total": {"wall": sum(t["wall"] for t in self.phases.values()),
+                          "cpu": sum(t["cpu"] for t in self.phases.values())},
+                "counts": self.counts}
+
+    def dump_stats(self, file_name: str) -> None:
+        # Writes the cProfile statistics to the given file, to be read with pstats or snakeviz
+        if not self.profiler:
+            raise ValueError("Profile was created without cprofile.")
+        self.profiler.dump_stats(file_name)
+
+
+def iter_days(spec: CalendarSpec, chunk_weeks: int = 53) -> Iterator[tuple[int, int, int, int, int, int]]:
+    # Yields (year, month, day, week, weekday, holiday) for every day of the padded day grid of the spec, where
+    # holiday is the number of the first holiday set of the spec holding the day, counting from 1, or 0
+    # The grid is built a chunk of whole weeks at a time, so memory use does not grow with the timespan. Holiday
+    # tables are looked up per chunk and held by the bounded cache of get_holiday_table().
+    # The padding of a grid ending in December 9999 is clipped at 9999-12-31, the last day of the datetime range.
+    first_day = datetime.date(spec.year_start, spec.month_start, 1)
+    last_day = datetime.date(spec.year_end, spec.month_end, get_month_length(spec.year_end, spec.month_end))
+    start = first_day.toordinal() - first_day.isoweekday() + 1
+    end = last_day.toordinal() + 7 - last_day.isoweekday()
+    max_ordinal = datetime.date.max.toordinal()
+
+    for chunk_start in range(start, end + 1, chunk_weeks * 7):
+        # DayGrid pads the chunk end to a Sunday again, past the datetime range if need be
+        chunk_first_day = datetime.date.fromordinal(chunk_start)
+        chunk_last_day = datetime.date.fromordinal(min(chunk_start + chunk_weeks * 7 - 1, end, max_ordinal))
+        holidays = get_holiday_layers(chunk_start, min(chunk_start + chunk_weeks * 7 - 1, end), spec.holidays)
+        grid = DayGrid(chunk_first_day, chunk_last_day, holidays)
+
+        # Follow the year and month along the grid instead of creating a date object per day
+        year, month = chunk_first_day.year, chunk_first_day.month
+        week, holiday = grid.week, grid.holiday
+        for i, day in enumerate(grid.day):
+            if day == 1 and i:
+                month += 1
+                if month == 13:
+                    year, month = year + 1, 1
+                    if year > 9999:
+                        return
+            yield year, month, day, week[i // 7], i % 7 + 1, holiday[i]
+
+
+def iter_csv_lines(spec: CalendarSpec) -> Iterator[str]:
+    # Yields the day grid of the spec as CSV lines, one day per line after the header, with the name of the holiday
+    # set marking the day in the holiday column
+    holiday_values = ("", *spec.holidays)
+    yield "date,week,weekday,holiday\r\n"
+    for year, month, day, week, weekday, holiday in iter_days(spec):
+        yield f"{year:04d}-{month:02d}-{day:02d},{week},{weekday},{holiday_values[holiday]}\r\n"
+
+
+def iter_jsonl_lines(spec: CalendarSpec) -> Iterator[str]:
+    # Yields the day grid of the spec as JSON Lines, one object per day
+    holiday_values = ("null", *(f'"{name}"' for name in spec.holidays))
+    for year, month, day, week, weekday, holiday in iter_days(spec):
+        yield (f'{{"date": "{year:04d}-{month:02d}-{day:02d}", "week": {week}, "weekday": {weekday}, '
+               f'"holiday": {holiday_values[holiday]}}}\n')
+
+
+def iter_ics_lines(spec: CalendarSpec) -> Iterator[str]:
+    # Yields an iCalendar file with the holidays in the day grid of the spec as all-day events
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\n"
+    yield "VERSION:2.0\r\n"
+    yield f"PRODID:-//XLCalendar//XLCalendar {opt['VERSION']}//EN\r\n"
+    yield "CALSCALE:GREGORIAN\r\n"
+    for year, month, day, week, weekday, holiday in iter_days(spec):
+        if holiday:
+            date = datetime.date(year, month, day)
+            holiday_set = spec.holidays[holiday - 1]
+            # A moved holiday can be named in the table of the year before or after, else fall back to the set name
+            name = next((names[date.toordinal()] for names in (get_holiday_names(y, holiday_set)
+                                                               for y in (year, year - 1, year + 1) if 1 <= y <= 9999)
+                         if date.toordinal() in names), holiday_set)
+            yield "BEGIN:VEVENT\r\n"
+            yield f"UID:{date:%Y%m%d}-{holiday_set}@xlcalendar\r\n"
+            yield f"DTSTAMP:{stamp}\r\n"
+            yield f"DTSTART;VALUE=DATE:{date:%Y%m%d}\r\n"
+            yield f"DTEND;VALUE=DATE:{date + datetime.timedelta(days=1):%Y%m%d}\r\n"
+            yield f"SUMMARY:{ics_escape(name)}\r\n"
+            yield f"CATEGORIES:{ics_escape(holiday_set)}\r\n"
+            yield "TRANSP:TRANSPARENT\r\n"
+            yield "END:VEVENT\r\n"
+    yield "END:VCALENDAR\r\n"
+
+
+def ics_escape(text: str) -> str:
+    # Returns the text escaped for an iCalendar text value
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+# Export formats other than XLSX, by name: functions yielding the lines of the exported file
+exporters = {"csv": iter_csv_lines, "jsonl": iter_jsonl_lines, "ics": iter_ics_lines}
+
+
+def export_to(spec: CalendarSpec, export_format: str, stream: TextIO) -> None:
+    # Streams the day grid of the spec in the given export format into the given text file-like object
+    # Nothing of the rendering stack is used, so the timespan is only limited by the datetime range.
+    if export_format not in exporters:
+        raise ValueError(f"Unknown export format: {export_format}")
+    stream.writelines(exporters[export_format](spec))
+
+
+def get_spec() -> CalendarSpec:
+    # Returns the spec of the calendar described by the command line options
+    # Exports don't lay out sheets, they are described in bands of a year so they can span any number of years.
+    band = opt['BAND'] if opt['BAND'] is not None or opt['FORMAT'] == "xlsx" else "year"
+    return CalendarSpec(opt['Y_S'], opt['M_S'], opt['Y_E'], opt['M_E'], opt['COLUMN_WIDTH'], opt['ROW_HEIGHT'],
+                        opt['FORCE_LANG'], tuple(opt['HOLIDAYS']), opt['RENDERER'],
+                        tuple(opt['MARK_FILES']), band, opt['BAND_SHEETS'], opt['COMPRESS_LEVEL'])
+
+
+def get_cache_key(spec: CalendarSpec) -> str:
+    # Returns the key of the spec's output in the cache: a hash of the normalized spec, the day and month names,
+    # holiday rules and contents of mark files it resolves to and the version of this tool
+    import hashlib
+    import json
+    weekday_dict, month_dict = get_names(spec.lang)
+    mark_hashes = []
+    for file_name in spec.marks:
+        with open(file_name, "rb") as f:
+            mark_hashes.append(hashlib.sha256(f.read()).hexdigest())
+    key = json.dumps([spec._asdict(), list(weekday_dict.values()), list(month_dict.values()),
+                      [holiday_sets[name].definition for name in spec.holidays], mark_hashes, opt['VERSION']],
+                     sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cached_file(spec: CalendarSpec, cache_dir: str) -> str | None:
+    # Returns the path of the cached output of the spec, or None if it is not in the cache
+    path = os.path.join(cache_dir, get_cache_key(spec) + ".xlsx")
+    try:
+        # Mark the entry as recently used for the eviction order
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+
+def add_cached_file(spec: CalendarSpec, cache_dir: str, file_name: str) -> None:
+    # Stores a copy of the rendered output of the spec in the cache and evicts the least recently used entries when
+    # the cache grows beyond its maximum size
+    import shutil
+    path = os.path.join(cache_dir, get_cache_key(spec) + ".xlsx")
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copyfile(file_name, temp_path)
+    os.replace(temp_path, path)
+
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".xlsx"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= opt['CACHE_MAX_BYTES']:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total -= size
+
+
+def update_cache_stats(cache_dir: str, hits: int, misses: int) -> None:
+    # Adds the given number of hits and misses to the statistics kept in the cache directory
+    import json
+    stats = get_cache_stats(cache_dir)
+    stats['hits'] += hits
+    stats['misses'] += misses
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump({"hits": stats['hits'], "misses": stats['misses']}, f)
+
+
+def get_cache_stats(cache_dir: str) -> dict:
+    # Returns the number of entries, their total size and the hit and miss counts of the cache
+    import json
+    stats = {"entries": 0, "bytes": 0, "hits": 0, "misses": 0}
+    try:
+        with open(os.path.join(cache_dir, "stats.json"), encoding="utf-8") as f:
+            counts = json.load(f)
+        stats['hits'], stats['misses'] = int(counts['hits']), int(counts['misses'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".xlsx"):
+                    stats['entries'] += 1
+                    stats['bytes'] += entry.stat().st_size
+    except OSError:
+        pass
+    return stats
+
+
+def print_cache_stats() -> None:
+    # Display the output cache statistics
+    stats = get_cache_stats(opt['CACHE_DIR'])
+    lookups = stats['hits'] + stats['misses']
+    print(f"\nOutput cache: {opt['CACHE_DIR']}")
+    print(f"    Entries:  {stats['entries']} ({stats['bytes'] / 1024 / 1024:.1f} of "
+          f"{opt['CACHE_MAX_BYTES'] / 1024 / 1024:.0f} MB)")
+    print(f"    Hits:     {stats['hits']} of {lookups} ({stats['hits'] / lookups if lookups else 0:.0%})")
+
+
+class OutputCounter(io.RawIOBase):
+    # Binary stream passing what is written on to another stream and counting the bytes, for outputs such as pipes
+    # that can't tell their position. zipfile finds it can't seek and writes the parts with trailing data descriptors.
+    __slots__ = ("stream", "bytes")
+
+    def __init__(self, stream: BinaryIO) -> None:
+        super().__init__()
+        self.stream = stream
+        self.bytes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.stream.write(data)
+        self.bytes += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.bytes
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def write_output(file_name: str, write: Callable[[BinaryIO], None]) -> int:
+    # Writes an output file with the given function, which writes to a binary file-like object, and returns the number
+    # of bytes written. The file name '-' writes to stdout. A file is written to a temporary file next to it first,
+    # which only replaces the file once it is complete, so a failed or interrupted run never leaves a partial file.
+    if file_name == "-":
+        stream = OutputCounter(sys.__stdout__.buffer)
+        write(stream)
+        stream.flush()
+        return stream.bytes
+
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "wb") as f:
+            write(f)
+            size = f.tell()
+        os.replace(temp_name, file_name)
+    except BaseException:
+        try:
+            os.remove(temp_name)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def print_saved(file_name: str, size: int, seconds: float, timed: str = "saved") -> None:
+    # Display where the output went, its size and the time it took, naming what was timed: calendars and exports are
+    # written while they are rendered, so their time includes the render
+    where = "stdout" if file_name == "-" else f"'{file_name}'"
+    print(f"\nFile saved to {where}: {size} bytes, {timed} in {seconds:.2f}s")
+
+
+def print_save_error(file_name: str, e: OSError) -> None:
+    # Display why the output could not be saved
+    where = "stdout" if file_name == "-" else f"file '{file_name}'"
+    if isinstance(e, PermissionError):
+        print(f"\nERROR: Permission Denied writing to {where}")
+    else:
+        print(f"\nERROR: Could not write to {where}: {e.strerror or e}")
+
+
+def save_calendar(spec: CalendarSpec, file_name: str, cache_dir: str | None, profile: Profile | None = None,
+                  workers: int = 1) -> tuple[bool, int]:
+    # Saves the calendar described by the spec to the given file or to stdout for '-', taking it from the cache in
+    # the given directory if possible. Returns whether the file came from the cache and the number of bytes written.
+    # Without a cache directory the cache is not used, and calendars written to stdout don't fill it.
+    if cache_dir:
+        cached_file = get_cached_file(spec, cache_dir)
+        if cached_file:
+            # Read before writing, so a file evicted or unreadable since it was found is rendered instead
+            try:
+                with open(cached_file, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                return True, write_output(file_name, lambda stream: stream.write(data))
+
+    size = write_output(file_name, lambda stream: render_to(spec, stream, profile, workers))
+
+    if cache_dir and file_name != "-":
+        try:
+            add_cached_file(spec, cache_dir, file_name)
+        except OSError:
+            # A cache that can't be written to is not a reason to fail
+            pass
+    return False, size
+
+
+def create_calendar_file() -> None:
+    spec = get_spec()
+    profile = Profile(cprofile=bool(opt['PROFILE_DUMP'])) if opt['PROFILE'] else None
+    if opt['FORMAT'] != "xlsx":
+        create_export_file(spec, profile)
+    else:
+        # A profiled render should really render
+        cache_dir = None if opt['NO_CACHE'] or profile else opt['CACHE_DIR']
+
+        # Render and save file to disk
+        try:
+            start = time.perf_counter()
+            cached, size = save_calendar(spec, opt['OUTPUT_FILE'], cache_dir, profile, opt['WORKERS'])
+            print_saved(opt['OUTPUT_FILE'], size, time.perf_counter() - start,
+                        "copied from cache" if cached else "rendered and saved")
+        except OSError as e:
+            print_save_error(opt['OUTPUT_FILE'], e)
+            exit()
+
+        if cache_dir:
+            try:
+                update_cache_stats(cache_dir, int(cached), int(not cached))
+            except OSError:
+                pass
+
+    if profile:
+        print_profile(spec, profile)
+
+
+def print_profile(spec: CalendarSpec, profile: Profile) -> None:
+    # Display the profile report as JSON and write the cProfile statistics if requested
+    import json
+    report = {"calendar": spec.title, "renderer": spec.renderer, "format": opt['FORMAT'], **profile.report()}
+    print(f"\nProfile:\n{json.dumps(report, indent=2)}")
+    if opt['PROFILE_DUMP']:
+        try:
+            profile.dump_stats(opt['PROFILE_DUMP'])
+            print(f"\ncProfile statistics saved as: '{opt['PROFILE_DUMP']}'")
+        except PermissionError:
+            print(f"\nERROR: Permission Denied writing to file '{opt['PROFILE_DUMP']}'")
+
+
+def extend_calendar_file() -> None:
+    from openpyxl import load_workbook
+    file_name = opt['EXTEND_FILE']
+    output_file = opt['OUTPUT_FILE'] if opt['OUTPUT_FILE_SET'] else file_name
+    print(f"\nExtending calendar '{file_name}' up to {opt['M_E']}-{opt['Y_E']}.")
+    try:
+        wb = load_workbook(file_name)
+    except OSError:
+        print(f"\nERROR: Can't read file '{file_name}'.")
+        exit()
+    except Exception:
+        print(f"\nERROR: File '{file_name}' is not an Excel workbook.")
+        exit()
+
+    # Check maximum span of full calendar
+    if isinstance(wb.active.cell(1, 1).value, int) and opt['Y_E'] - wb.active.cell(1, 1).value > 100:
+        print(f"\nERROR: Calendar cannot span more than 100 years.")
+        exit()
+
+    try:
+        weeks = extend_workbook(wb, opt['Y_E'], opt['M_E'], tuple(opt['HOLIDAYS']), tuple(opt['MARK_FILES']),
+                                opt['FORCE_LANG'])
+    except ValueError as e:
+        print(f"\nERROR: Can't extend '{file_name}': {e}")
+        exit()
+    if not weeks:
+        print(f"\nCalendar already runs up to {opt['M_E']}-{opt['Y_E']}, nothing to add.")
+        return
+
+    # Saved through a temporary file, so a failed save leaves the old file intact
+    try:
+        start = time.perf_counter()
+        size = write_output(output_file, lambda stream: save_workbook(wb, stream, opt['COMPRESS_LEVEL']))
+        print(f"\nAdded {weeks} weeks.")
+        print_saved(output_file, size, time.perf_counter() - start)
+    except OSError as e:
+        print_save_error(output_file, e)
+        exit()
+
+
+def create_export_file(spec: CalendarSpec, profile: Profile | None = None) -> None:
+    # Stream the export to disk, exports are cheap to redo and never cached
+    def write(stream: BinaryIO) -> None:
+        file = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        if profile:
+            profile.start()
+        export_to(spec, opt['FORMAT'], file)
+        file.flush()
+        if profile:
+            profile.lap("export")
+            profile.stop()
+        file.detach()
+
+    try:
+        start = time.perf_counter()
+        size = write_output(opt['OUTPUT_FILE'], write)
+        print_saved(opt['OUTPUT_FILE'], size, time.perf_counter() - start, "exported")
+    except OSError as e:
+        print_save_error(opt['OUTPUT_FILE'], e)
+        exit()
+    if profile:
+        profile.counts["bytes"] = size
+
+
+def load_manifest(file_name: str) -> list[tuple[CalendarSpec, str]]:
+    # Returns the (spec, output file) jobs listed in a JSON or CSV manifest
+    # Entries use the CalendarSpec field names plus 'output', see get_spec_kwargs().
+    import csv
+    import json
+    with open(file_name, newline="", encoding="utf-8") as f:
+        if file_name.lower().endswith(".csv"):
+            entries = list(csv.DictReader(f))
+        else:
+            entries = json.load(f)
+
+    if not isinstance(entries, list):
+        raise ValueError("Manifest should hold a list of entries.")
+    jobs = []
+    for i, entry in enumerate(entries, 1):
+        try:
+            if not isinstance(entry, dict):
+                raise TypeError("Manifest entries should be objects.")
+            entry = {key: value for key, value in entry.items() if value not in (None, "")}
+            kwargs = get_spec_kwargs(entry)
+            output = entry["output"]
+            if not isinstance(output, str):
+                raise TypeError("Manifest output should be a file name.")
+        except KeyError as e:
+            raise ValueError(f"Manifest entry {i} is missing '{e.args[0]}'.")
+        except (TypeError, ValueError):
+            raise ValueError(f"Manifest entry {i} has an invalid value.")
+        try:
+            spec = CalendarSpec(**kwargs)
+        except ValueError as e:
+            raise ValueError(f"Manifest entry {i}: {e}")
+        jobs.append((spec, output if output.lower().endswith(".xlsx") else output + ".xlsx"))
+    return jobs
+
+
+def get_spec_kwargs(entry: dict) -> dict:
+    # Returns the CalendarSpec arguments of a manifest entry or query, keyed by the CalendarSpec field names
+    # Values may be strings, as in CSV files and query strings: holiday sets are separated by spaces, mark files by
+    # semicolons and band_sheets is 1, true or yes. Raises KeyError for a missing date field and TypeError or
+    # ValueError for an invalid value.
+    kwargs = {key: int(entry[key]) for key in ("year_start", "month_start", "year_end", "month_end")}
+    for key in ("column_width", "row_height"):
+        if key in entry:
+            kwargs[key] = float(entry[key])
+    for key in ("lang", "renderer"):
+        if key in entry:
+            kwargs[key] = entry[key]
+    if "band" in entry:
+        band = entry["band"]
+        kwargs["band"] = band if isinstance(band, str) and not band.isdigit() else int(band)
+    if "band_sheets" in entry:
+        band_sheets = entry["band_sheets"]
+        kwargs["band_sheets"] = (band_sheets.lower() in ("1", "true", "yes") if isinstance(band_sheets, str)
+                                 else bool(int(band_sheets)))
+    if "compress_level" in entry:
+        kwargs["compress_level"] = int(entry["compress_level"])
+    if "holidays" in entry:
+        holidays = entry["holidays"]
+        kwargs["holidays"] = tuple(holidays.split() if isinstance(holidays, str) else holidays)
+    if "marks" in entry:
+        marks = entry["marks"]
+        kwargs["marks"] = tuple(marks.split(";") if isinstance(marks, str) else marks)
+    return kwargs
+
+
+def init_batch_worker(year_start: int, year_end: int, use_openpyxl: bool, holiday_definitions: list[dict]) -> None:
+    # Warms up a batch worker process once, so its renders reuse the imported modules and holiday tables
+    # The holiday sets of the batch are passed along, as workers that are spawned only know the built-in sets. Jobs
+    # look up their holidays per band, so the tables per year are warmed, as many as their cache holds.
+    if use_openpyxl:
+        import openpyxl  # noqa: F401
+        for key in font_dict:
+            get_font(key)
+    years = get_holiday_table.cache_info().maxsize // max(len(holiday_definitions), 1)
+    first_year = max(year_start - 1, 1)
+    last_year = min(year_end + 1, 9999, first_year + years - 1)
+    # All sets are added before warming, as replacing a set clears the tables
+    names = [add_holiday_set(definition) for definition in holiday_definitions]
+    for name in names:
+        for year in range(first_year, last_year + 1):
+            get_holiday_table(year, name)
+
+
+def render_batch_job(spec: CalendarSpec, output: str, cache_dir: str | None) -> tuple[int, float, bool]:
+    # Renders a single batch job to its output file, returns the file size, the render time and whether the file
+    # came from the cache
+    start = time.perf_counter()
+    cached, size = save_calendar(spec, output, cache_dir)
+    return size, time.perf_counter() - start, cached
+
+
+def run_batch(jobs: list[tuple[CalendarSpec, str]], workers: int, cache_dir: str | None = None) -> list[dict]:
+    # Renders all jobs on a pool of warm worker processes and returns a summary record per job
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    year_start = min(spec.year_start for spec, _ in jobs)
+    year_end = max(spec.year_end for spec, _ in jobs)
+    use_openpyxl = any(spec.renderer != "native" for spec, _ in jobs)
+    holiday_definitions = [holiday_sets[name].definition
+                           for name in dict.fromkeys(name for spec, _ in jobs for name in spec.holidays)]
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                             initargs=(year_start, year_end, use_openpyxl, holiday_definitions)) as executor:
+        futures = {executor.submit(render_batch_job, spec, output, cache_dir): output for spec, output in jobs}
+        for future in as_completed(futures):
+            record = {"output": futures[future], "bytes": None, "seconds": None, "cached": False, "error": None}
+            try:
+                record["bytes"], record["seconds"], record["cached"] = future.result()
+            except Exception as e:
+                record["error"] = str(e) or type(e).__name__
+            summary.append(record)
+    return summary
+
+
+def create_batch_files() -> None:
+    # Renders all calendars of the batch manifest and prints a summary of outputs and timings
+    try:
+        jobs = load_manifest(opt['BATCH_FILE'])
+    except OSError:
+        print(f"\nERROR: Could not read manifest file '{opt['BATCH_FILE']}'")
+        exit()
+    except ValueError as e:
+        print(f"\nERROR: Invalid manifest file '{opt['BATCH_FILE']}': {e}")
+        exit()
+    if not jobs:
+        print(f"\nManifest file '{opt['BATCH_FILE']}' lists no calendars.")
+        return
+
+    workers = min(opt['WORKERS'], len(jobs))
+    print(f"\nCreating {len(jobs)} calendars with {workers} worker processes.\n")
+    cache_dir = None if opt['NO_CACHE'] else opt['CACHE_DIR']
+    start = time.perf_counter()
+    summary = run_batch(jobs, workers, cache_dir)
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for record in summary:
+        if record["error"]:
+            failed += 1
+            print(f"    FAILED  {record['output']}: {record['error']}")
         else:
-            c.border = border_R
+            print(f"    {record['seconds']:7.3f}s {record['bytes']:>10} bytes  {record['output']}"
+                  f"{' (from cache)' if record['cached'] else ''}")
+    print(f"\n{len(summary) - failed} of {len(summary)} calendars saved in {elapsed:.2f}s "
+          f"({len(summary) / elapsed:.1f} calendars/s).")
+
+    if cache_dir:
+        hits = sum(record['cached'] for record in summary)
+        try:
+            update_cache_stats(cache_dir, hits, len(summary) - failed - hits)
+        except OSError:
+            pass
+
+
+# Calendar server
+# A local HTTP endpoint rendering calendars from query parameters: GET /calendar takes the CalendarSpec field names
+# of batch manifests plus 'format', GET /metrics reports the cache hit rate and latency percentiles as JSON. Renders
+# run on a pool of warm worker processes, identical requests in flight share one render and finished files are kept
+# in an in-memory LRU bounded in bytes. Mark files are not accepted over HTTP, as they would be read from the
+# server's disk.
+server_query_keys = frozenset(CalendarSpecFields._fields) - {"marks"} | {"format"}
+server_content_types = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        "csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson; charset=utf-8",
+                        "ics": "text/calendar; charset=utf-8"}
+http_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+def render_format(spec: CalendarSpec, export_format: str) -> bytes:
+    # Returns the calendar described by the spec as the bytes of a file in the given format
+    if export_format == "xlsx":
+        return render(spec)
+    stream = io.StringIO(newline="")
+    export_to(spec, export_format, stream)
+    return stream.getvalue().encode()
+
+
+def text_response(status: int, message: str, headers: Sequence[str] = ()) -> tuple[int, str, bytes, list[str]]:
+    # Returns a plain text response of the calendar server
+    return status, "text/plain; charset=utf-8", f"{message}\n".encode(), list(headers)
+
+
+def get_percentiles(samples: Iterable[float]) -> dict[str, float | None]:
+    # Returns the 50th, 90th and 99th percentile (nearest rank) and the maximum of the given seconds in milliseconds
+    ordered = sorted(samples)
+    percentiles = {}
+    for p in (50, 90, 99):
+        percentiles[f"p{p}"] = round(ordered[-(-p * len(ordered) // 100) - 1] * 1000, 3) if ordered else None
+    percentiles["max"] = round(ordered[-1] * 1000, 3) if ordered else None
+    return percentiles
+
+
+class CalendarServer:
+    # Request handling, render coalescing, LRU and metrics of the calendar server
+    # The server runs on a single event loop thread, so its state needs no locks. A render in flight is an asyncio
+    # future in the inflight dict until it is done, and every request for the same key awaits that future instead
+    # of starting a render of its own.
+    __slots__ = ("executor", "max_bytes", "cache", "cache_bytes", "inflight", "counts", "latencies", "render_times")
+
+    def __init__(self, executor, max_bytes: int) -> None:
+        from collections import OrderedDict, deque
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.inflight = {}
+        self.counts = {"requests": 0, "errors": 0, "hits": 0, "coalesced": 0, "renders": 0, "evictions": 0}
+        # Latencies of the latest calendar requests and renders in seconds
+        self.latencies = deque(maxlen=1024)
+        self.render_times = deque(maxlen=1024)
+
+    async def handle(self, reader, writer) -> None:
+        # Answers a single HTTP request on the connection and closes it
+        import asyncio
+        start = time.perf_counter()
+        self.counts["requests"] += 1
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # The headers are not used, but have to be read
+            while (await asyncio.wait_for(reader.readline(), 10)).strip():
+                pass
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            writer.close()
+            return
+
+        status, content_type, body, headers = await self.respond(method, target)
+        if status >= 400:
+            self.counts["errors"] += 1
+        head = [f"HTTP/1.1 {status} {http_reasons[status]}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}", "Connection: close", *headers]
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        if target.startswith("/calendar") and status == 200:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def respond(self, method: str, target: str) -> tuple[int, str, bytes, list[str]]:
+        # Returns the status, content type, body and extra headers of the response to a request
+        import json
+        from urllib.parse import parse_qs, urlsplit
+        url = urlsplit(target)
+        if url.path not in ("/calendar", "/metrics"):
+            return text_response(404, "Not found, use /calendar or /metrics.")
+        if method != "GET":
+            return text_response(405, "Only GET is supported.", ["Allow: GET"])
+        if url.path == "/metrics":
+            return 200, "application/json", json.dumps(self.get_metrics(), indent=2).encode(), []
+
+        # Repeated values are joined, so holiday sets can be given one parameter each
+        query = {key: " ".join(values) for key, values in parse_qs(url.query).items()}
+        unknown = set(query) - server_query_keys
+        if unknown:
+            return text_response(400, f"Unknown parameter: {', '.join(sorted(unknown))}")
+        export_format = query.pop("format", "xlsx")
+        if export_format not in server_content_types:
+            return text_response(400, f"Unsupported format: {export_format}")
+        # Same defaults as the command line: January of this year up to January of the next
+        query.setdefault("year_start", str(datetime.date.today().year))
+        query.setdefault("month_start", "1")
+        query.setdefault("year_end", str(int(query["year_start"]) + 1) if query["year_start"].isdigit() else "")
+        query.setdefault("month_end", "1")
+        try:
+            kwargs = get_spec_kwargs(query)
+        except (KeyError, TypeError, ValueError):
+            return text_response(400, "Invalid parameter value.")
+        if export_format != "xlsx":
+            # Exports don't lay out sheets, bands of a year let them span any number of years
+            kwargs.setdefault("band", "year")
+        try:
+            spec = CalendarSpec(**kwargs)
+        except ValueError as e:
+            return text_response(400, str(e))
+
+        try:
+            data = await self.get_calendar(f"{get_cache_key(spec)}.{export_format}", spec, export_format)
+        except Exception as e:
+            return text_response(500, f"Render failed: {str(e) or type(e).__name__}")
+        file_name = f"Calendar {spec.title}.{export_format}"
+        return (200, server_content_types[export_format], data,
+                [f'Content-Disposition: attachment; filename="{file_name}"'])
+
+    async def get_calendar(self, key: str, spec: CalendarSpec, export_format: str) -> bytes:
+        # Returns the file of the spec from the LRU, from a render in flight or from a new render
+        import asyncio
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            self.counts["hits"] += 1
+            return data
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counts["coalesced"] += 1
+        else:
+            self.counts["renders"] += 1
+            start = time.perf_counter()
+            future = asyncio.get_running_loop().run_in_executor(self.executor, render_format, spec, export_format)
+            self.inflight[key] = future
+            future.add_done_callback(lambda done: self.finish_render(key, done, start))
+        # A client that goes away does not cancel the render the other clients are waiting for
+        return await asyncio.shield(future)
+
+    def finish_render(self, key: str, future, start: float) -> None:
+        # Moves a finished render from the inflight dict into the LRU
+        del self.inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.render_times.append(time.perf_counter() - start)
+        data = future.result()
+        if len(data) > self.max_bytes:
+            return
+        self.cache[key] = data
+        self.cache_bytes += len(data)
+        while self.cache_bytes > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= len(evicted)
+            self.counts["evictions"] += 1
+
+    def get_metrics(self) -> dict:
+        # Returns the request counts, cache state and latency percentiles of the server
+        lookups = self.counts["hits"] + self.counts["coalesced"] + self.counts["renders"]
+        return {**self.counts,
+                "hit_rate": round(self.counts["hits"] / lookups, 4) if lookups else None,
+                "inflight": len(self.inflight),
+                "cache": {"entries": len(self.cache), "bytes": self.cache_bytes, "max_bytes": self.max_bytes},
+                "latency_ms": get_percentiles(self.latencies),
+                "render_ms": get_percentiles(self.render_times)}
+
+
+def serve_calendars() -> None:
+    # Runs the calendar server until it is interrupted
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    host, port = opt['SERVE']
+    year = datetime.date.today().year
+    holiday_definitions = [holiday_set.definition for holiday_set in holiday_sets.values()]
+    with ProcessPoolExecutor(max_workers=opt['WORKERS'], initializer=init_batch_worker,
+                             initargs=(year, year + 1, True, holiday_definitions)) as executor:
+        server = CalendarServer(executor, opt['SERVE_CACHE_BYTES'])
+
+        async def run() -> None:
+            tcp_server = await asyncio.start_server(server.handle, host, port)
+            print(f"\nServing calendars on http://{host}:{port}/calendar with {opt['WORKERS']} worker processes, "
+                  f"metrics on /metrics. Press Ctrl+C to stop.")
+            async with tcp_server:
+                await tcp_server.serve_forever()
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+        except OSError as e:
+            print(f"\nERROR: Can't serve on {host}:{port}: {e.strerror}")
+
+
+def build_workbook(spec: CalendarSpec, profile: Profile | None = None) -> "Workbook":
+    # Renders the calendar into a regular openpyxl workbook in a single pass over its bands
+    # Every distinct cell style is registered once as a named style, so cells only get a reference to it.
+    from openpyxl import Workbook
+    from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+    wb = Workbook()
+    sheets = get_sheets(spec)
+    wb.active.title = sheets[0][0]
+    for title, _, _ in sheets[1:]:
+        wb.create_sheet(title)
+    if profile:
+        profile.lap("setup")
+
+    # Write all values and styles, including the edge borders of the cells covered by merged ranges
+    style_names = {}
+    merges = [[] for _ in sheets]
+    for band, layout in iter_layouts(spec, profile):
+        ws = wb.worksheets[band.sheet]
+        for row in range(1, 10):
+            for col, (value, style) in enumerate(layout.iter_row(row), 1):
+                if style not in style_names:
+                    style_names[style] = add_named_style(wb, f"Calendar {len(style_names) + 1}", style)
+                c = ws.cell(row=band.row + row, column=col, value=value)
+                c.style = style_names[style]
+        merges[band.sheet].extend(CellRange(min_row=band.row + start_row, min_col=start_col,
+                                            max_row=band.row + end_row, max_col=end_col)
+                                  for start_row, start_col, end_row, end_col in layout.merges)
+        if profile:
+            profile.lap("cells")
+
+    # Merge the row header cells and the header cells of corresponding months at once per sheet, their borders are
+    # already part of the layout
+    for ws, sheet_merges in zip(wb.worksheets, merges):
+        ws.merged_cells = MultiCellRange(sheet_merges)
+    if profile:
+        profile.lap("merges")
+
+    for ws, (_, last_column, last_row) in zip(wb.worksheets, sheets):
+        set_sheet_setup(ws, spec, last_column, last_row)
+    if profile:
+        profile.lap("page_setup")
+
+    return wb
 
-    # Apply borders to weeknumbers row
-    for col in range(3, last_column):
-        ws.cell(row=9, column=col).border = border_lrtB
-    ws.cell(row=9, column=last_column).border = border_lRtB
+
+def set_sheet_setup(ws, spec: CalendarSpec, last_column: int, last_row: int) -> None:
+    # Applies the column widths, row heights, print area and page setup of a calendar sheet to a worksheet
+    from openpyxl.worksheet.worksheet import Worksheet
+    for i in range(1, last_column + 1):
+        ws.column_dimensions[column_letter(i)].width = spec.column_width
+    for i in range(1, last_row + 1):
+        # The empty rows between stacked bands keep the default height
+        if i % band_rows:
+            ws.row_dimensions[i].height = spec.row_height
 
     # Apply page setup and set printing options
-    ws.print_area = f"A1:{get_column_letter(last_column)}9"
+    ws.print_area = f"A1:{column_letter(last_column)}{last_row}"
     ws.print_options.horizontalCentered = True
     ws.print_options.verticalCentered = True
-    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-    ws.page_setup.paperSize = ws.PAPERSIZE_A4
+    ws.page_setup.orientation = Worksheet.ORIENTATION_LANDSCAPE
+    ws.page_setup.paperSize = Worksheet.PAPERSIZE_A4
     ws.page_setup.fitToPage = True
+    if last_row > 9:
+        # Stacked bands are fitted to the page width and printed on as many pages as they need
+        ws.page_setup.fitToHeight = 0
 
-    # Save file to disk
-    try:
-        wb.save(opt['OUTPUT_FILE'])
-        print(f"\nFile saved as: '{opt['OUTPUT_FILE']}'")
-    except PermissionError:
-        print(f"\nERROR: Permission Denied writing to file '{opt['OUTPUT_FILE']}'")
-        exit()
+
+def add_named_style(wb: "Workbook", name: str, style: tuple) -> str:
+    # Registers the templates of the given style keys as a named style in the workbook and returns its name
+    from openpyxl.styles import NamedStyle
+    from openpyxl.styles.fonts import DEFAULT_FONT
+    font, alignment, fill, border = style
+    named_style = NamedStyle(name=name, font=DEFAULT_FONT if font is None else get_font(font))
+    if alignment is not None:
+        named_style.alignment = get_alignment(alignment)
+    if fill is not None:
+        named_style.fill = get_fill(fill)
+    if border is not None:
+        named_style.border = get_border(border)
+    wb.add_named_style(named_style)
+    return name
+
+
+def build_write_only_workbook(spec: CalendarSpec, profile: Profile | None = None) -> "Workbook":
+    # Renders the calendar into a write-only workbook, which streams rows to disk instead of keeping every cell
+    # and its style in memory. Bands are laid out one at a time as their rows are streamed.
+    from openpyxl import Workbook
+    from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+    wb = Workbook(write_only=True)
+    sheets = get_sheets(spec)
+    if profile:
+        profile.lap("setup")
+    ws = None
+    for band, layout in iter_layouts(spec, profile):
+        if ws is None or band.sheet == len(wb.worksheets):
+            # Sheet properties have to be set before the first row is written, merged ranges are written when the
+            # sheet is closed
+            title, last_column, last_row = sheets[band.sheet]
+            ws = wb.create_sheet(title)
+            set_sheet_setup(ws, spec, last_column, last_row)
+            ws.merged_cells = MultiCellRange()
+            if profile:
+                profile.lap("page_setup")
+        else:
+            # Empty row between stacked bands
+            ws.append(())
+
+        # Stream the rows
+        for row in range(1, 10):
+            ws.append(write_only_cell(ws, value, style) for value, style in layout.iter_row(row))
+        ws.merged_cells.ranges.update(CellRange(min_row=band.row + start_row, min_col=start_col,
+                                                max_row=band.row + end_row, max_col=end_col)
+                                      for start_row, start_col, end_row, end_col in layout.merges)
+        if profile:
+            profile.lap("cells")
+
+    return wb
+
+
+def write_only_cell(ws, value: object, style: tuple) -> "WriteOnlyCell":
+    # Returns a write-only cell with the given value and the templates of the given style keys
+    from openpyxl.cell import WriteOnlyCell
+    font, alignment, fill, border = style
+    c = WriteOnlyCell(ws, value)
+    if font is not None:
+        c.font = get_font(font)
+    if alignment is not None:
+        c.alignment = get_alignment(alignment)
+    if fill is not None:
+        c.fill = get_fill(fill)
+    if border is not None:
+        c.border = get_border(border)
+    return c
+
+
+def set_cell_style(c, style: tuple) -> None:
+    # Applies the templates of the given style keys to an existing cell, None resets to the default
+    from openpyxl.styles import Alignment, Border, PatternFill
+    from openpyxl.styles.fonts import DEFAULT_FONT
+    font, alignment, fill, border = style
+    c.font = DEFAULT_FONT if font is None else get_font(font)
+    c.alignment = Alignment() if alignment is None else get_alignment(alignment)
+    c.fill = PatternFill() if fill is None else get_fill(fill)
+    c.border = Border() if border is None else get_border(border)
+
+
+def save_workbook(wb: "Workbook", stream: BinaryIO, compress_level: int | None = None) -> None:
+    # Saves the workbook into the binary file-like object like wb.save(), with the given compression level
+    import zipfile
+    from openpyxl.writer.excel import ExcelWriter
+    compression, compresslevel = get_zip_compression(compress_level)
+    wb.properties.modified = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    ExcelWriter(wb, zipfile.ZipFile(stream, "w", compression, allowZip64=True, compresslevel=compresslevel)).save()
+
+
+def find_last_week(ws) -> tuple[int, int]:
+    # Returns the last week column of a calendar sheet and the ordinal of the Monday of that week
+    # The first week is found from its ISO week in row 9 and its Monday in row 2: it is the week holding the first
+    # day of the start month, in the year of the sheet's header.
+    year, first_week, first_monday = ws.cell(1, 1).value, ws.cell(9, 3).value, ws.cell(2, 3).value
+    last_column = ws.max_column
+    if not all(isinstance(value, int) for value in (year, first_week, first_monday)) or last_column < 3:
+        raise ValueError("Sheet is not a calendar made by XLCalendar.")
+    monday = None
+    for iso_year in (year, year - 1):
+        try:
+            candidate = datetime.date.fromisocalendar(iso_year, first_week, 1)
+        except ValueError:
+            continue
+        if candidate.day == first_monday and datetime.date(year - 1, 12, 26) <= candidate <= datetime.date(year, 12, 1):
+            monday = candidate.toordinal()
+    if monday is None:
+        raise ValueError("Sheet is not a calendar made by XLCalendar.")
+
+    # The last week has to match its week number and Monday
+    last_monday = monday + 7 * (last_column - 3)
+    last_date = datetime.date.fromordinal(last_monday)
+    if ws.cell(9, last_column).value != last_date.isocalendar()[1] or ws.cell(2, last_column).value != last_date.day:
+        raise ValueError("Last week of the sheet does not match the first one, was it edited?")
+    return last_column, last_monday
+
+
+def extend_workbook(wb: "Workbook", year_end: int, month_end: int, holidays: tuple[str, ...] = (),
+                    marks: tuple[str, ...] = (), lang: str | None = None) -> int:
+    # Appends the weeks up to the end of the given month to the calendar sheet of a workbook made by this tool and
+    # returns the number of added weeks
+    # Only the new week columns are written, plus the last month header run and the closing right edge of the old
+    # last week, so the work is proportional to the added weeks.
+    from openpyxl.worksheet.cell_range import CellRange
+    ws = wb.active
+    if len(wb.worksheets) > 1 or ws.max_row > 9:
+        raise ValueError("Calendars split into bands can't be extended.")
+    last_column, last_monday = find_last_week(ws)
+    last_day = datetime.date(year_end, month_end, get_month_length(year_end, month_end))
+    if last_day.toordinal() < last_monday + 7:
+        return 0
+
+    # The old last month header run is merged again with the new weeks of the same month
+    run_start = last_column
+    for merged in ws.merged_cells.ranges:
+        if merged.min_row == 1 and merged.min_col <= last_column <= merged.max_col and merged.min_col >= 3:
+            run_start = merged.min_col
+            ws.unmerge_cells(start_row=1, start_column=merged.min_col, end_row=1, end_column=merged.max_col)
+            break
+    run_monday = datetime.date.fromordinal(last_monday - 7 * (last_column - run_start))
+
+    # Keep the language of the sheet, unless another one is forced
+    # The weekday labels in column A tell most languages apart, and the month headers those sharing their labels.
+    # Only Monday to Friday are compared, as earlier versions labeled the French Saturday 'Ven'.
+    if lang is None:
+        catalog = get_locale_catalog()
+        labels = tuple(ws.cell(row, 1).value for row in range(2, 7))
+        headers = {cell.value for cell in ws[1][2:] if isinstance(cell.value, str)}
+        candidates = [candidate for candidate, names in catalog.items() if names.weekdays[:5] == labels]
+        lang = next((candidate for candidate in candidates if headers <= set(catalog[candidate].months)),
+                    candidates[0] if candidates else None)
+    weekday_dict, month_dict = get_names(lang)
+
+    # Lay out the weeks from the start of the old last run, with column 3 of that layout at run_start
+    layers = get_holiday_layers(run_monday.toordinal(), last_day.toordinal() + 7 - last_day.isoweekday(), holidays)
+    grid = DayGrid(run_monday, last_day, layers)
+    layout = SheetLayout(grid, weekday_dict, month_dict, ws.cell(1, 1).value,
+                         tuple(holiday_sets[name].fill for name in holidays), get_marks(marks))
+    shift = run_start - 3
+    for row in range(1, 10):
+        # The header row is written from the start of the run, the day and week rows from the old last week on,
+        # which loses its closing right edge
+        first_column = run_start if row == 1 else last_column
+        for col, (value, style) in enumerate(layout.iter_row(row), shift + 1):
+            if col < first_column:
+                continue
+            if row == 1 and col == run_start:
+                value = ws.cell(1, col).value
+            set_cell_style(ws.cell(row=row, column=col, value=value), style)
+    for start_row, start_col, end_row, end_col in layout.merges:
+        if start_row == 1 and start_col >= 3:
+            ws.merged_cells.add(CellRange(min_row=1, min_col=start_col + shift, max_row=1, max_col=end_col + shift))
+
+    # Size the new columns like the first week column and print the whole sheet
+    new_last_column = layout.last_column + shift
+    # (Renderers may store the widths of several columns as one range)
+    width = next((dimension.width for dimension in ws.column_dimensions.values()
+                  if dimension.min and dimension.max and dimension.min <= 3 <= dimension.max), None)
+    if width:
+        for col in range(last_column + 1, new_last_column + 1):
+            ws.column_dimensions[column_letter(col)].width = width
+    ws.print_area = f"A1:{column_letter(new_last_column)}9"
+    if " to " in ws.title:
+        ws.title = f"{ws.title.split(' to ')[0]} to {month_end}-{year_end}"
+    return new_last_column - last_column
+
+
+# Static parts of the XLSX package written by the native writer
+xlsx_content_types = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{sheets}'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/docProps/core.xml" '
+    'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '<Override PartName="/docProps/app.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>'
+    '</Types>'
+)
+xlsx_root_rels = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '<Relationship Id="rId2" Target="docProps/core.xml" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties"/>'
+    '<Relationship Id="rId3" Target="docProps/app.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/extended-properties"/>'
+    '</Relationships>'
+)
+xlsx_workbook_rels = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}'
+    '<Relationship Id="rId{styles_id}" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>'
+)
+xlsx_sheet_content_type = (
+    '<Override PartName="/xl/worksheets/sheet{number}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+xlsx_sheet_rel = (
+    '<Relationship Id="rId{number}" Target="worksheets/sheet{number}.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+)
+xlsx_app = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+    '<Application>Microsoft Excel</Application></Properties>'
+)
+
+
+def xml_escape(text: str) -> str:
+    # Returns the text escaped for use in XML content and attribute values
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def get_native_styles_xml(styles: list[tuple]) -> str:
+    # Returns the styles part for the given list of styles, style i of the list gets cell format index i + 1
+    fonts, fills, borders = [], [], []
+    xfs = ['<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>']
+    for font, alignment, fill, border in styles:
+        font_id = fill_id = border_id = 0
+        if font is not None:
+            if font not in fonts:
+                fonts.append(font)
+            font_id = fonts.index(font) + 1
+        if fill is not None:
+            if fill not in fills:
+                fills.append(fill)
+            fill_id = fills.index(fill) + 2
+        if border is not None:
+            if border not in borders:
+                borders.append(border)
+            border_id = borders.index(border) + 1
+        if alignment is None:
+            xfs.append(f'<xf numFmtId="0" fontId="{font_id}" fillId="{fill_id}" borderId="{border_id}" xfId="0"'
+                       f' applyFont="1" applyFill="1" applyBorder="1"/>')
+        else:
+            xfs.append(f'<xf numFmtId="0" fontId="{font_id}" fillId="{fill_id}" borderId="{border_id}" xfId="0"'
+                       f' applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">'
+                       f'<alignment horizontal="{alignment}" vertical="center"/></xf>')
+
+    font_xml = ['<font><sz val="11"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>']
+    for font in fonts:
+        name, size, bold = font_dict[font]
+        font_xml.append(f'<font>{"<b/>" if bold else ""}<sz val="{size}"/><name val="{name}"/></font>')
+    fill_xml = ['<fill><patternFill patternType="none"/></fill>', '<fill><patternFill patternType="gray125"/></fill>']
+    for fill in fills:
+        fill_xml.append(f'<fill><patternFill patternType="solid"><fgColor rgb="00{fill}"/></patternFill></fill>')
+    border_xml = ['<border><left/><right/><top/><bottom/><diagonal/></border>']
+    for border in borders:
+        sides = {border_sides[k.lower()]: "thin" if k.islower() else "medium" for k in border}
+        border_xml.append("<border>" + "".join(
+            f'<{side} style="{sides[side]}"><color rgb="00000000"/></{side}>' if side in sides else f"<{side}/>"
+            for side in ("left", "right", "top", "bottom")) + "<diagonal/></border>")
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f'<fonts count="{len(font_xml)}">{"".join(font_xml)}</fonts>'
+        f'<fills count="{len(fill_xml)}">{"".join(fill_xml)}</fills>'
+        f'<borders count="{len(border_xml)}">{"".join(border_xml)}</borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    )
+
+
+def get_zip_compression(compress_level: int | None) -> tuple[int, int | None]:
+    # Returns the zipfile compression method and level of the parts of a file saved with the given compression level
+    # Level 0 stores the parts uncompressed and no level is zlib's default level 6.
+    import zipfile
+    if compress_level == 0:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, compress_level
+
+
+def write_native_workbook(spec: CalendarSpec, file: BinaryIO, profile: Profile | None = None,
+                          workers: int = 1) -> None:
+    # Writes the calendar as an XLSX package straight through zipfile, bypassing openpyxl's object model
+    # The styles part is prebuilt from the fixed list of layout styles and the sheets are streamed band by band.
+    import zipfile
+    sheets = get_sheets(spec)
+    styles = get_layout_styles(tuple(holiday_sets[name].fill for name in spec.holidays), get_marks(spec.marks))
+    style_index = {style: i + 1 for i, style in enumerate(styles)}
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if profile:
+        profile.lap("setup")
+
+    sheet_names, print_areas = [], []
+    for i, (title, last_column, last_row) in enumerate(sheets):
+        sheet_name = xml_escape(title)
+        sheet_names.append(f'<sheet name="{sheet_name}" sheetId="{i + 1}" r:id="rId{i + 1}"/>')
+        print_areas.append(f'<definedName name="_xlnm.Print_Area" localSheetId="{i}">'
+                           f"'{sheet_name.replace(chr(39), chr(39) * 2)}'!$A$1:${column_letter(last_column)}"
+                           f"${last_row}</definedName>")
+
+    compression, compresslevel = get_zip_compression(spec.compress_level)
+    with zipfile.ZipFile(file, "w", compression, compresslevel=compresslevel) as zf:
+        zf.writestr("[Content_Types].xml", xlsx_content_types.format(
+            sheets="".join(xlsx_sheet_content_type.format(number=i + 1) for i in range(len(sheets)))))
+        zf.writestr("_rels/.rels", xlsx_root_rels)
+        zf.writestr("docProps/app.xml", xlsx_app)
+        zf.writestr("docProps/core.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><dc:creator>XLCalendar</dc:creator>'
+            f'<dcterms:created xsi:type="dcterms:W3CDTF">{now}</dcterms:created>'
+            f'<dcterms:modified xsi:type="dcterms:W3CDTF">{now}</dcterms:modified></cp:coreProperties>'
+        ))
+        zf.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<bookViews><workbookView activeTab="0"/></bookViews>'
+            f'<sheets>{"".join(sheet_names)}</sheets>'
+            f'<definedNames>{"".join(print_areas)}</definedNames>'
+            '<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>'
+        ))
+        zf.writestr("xl/_rels/workbook.xml.rels", xlsx_workbook_rels.format(
+            sheets="".join(xlsx_sheet_rel.format(number=i + 1) for i in range(len(sheets))), styles_id=len(sheets) + 1))
+        zf.writestr("xl/styles.xml", get_native_styles_xml(styles))
+
+        for sheet, bands in groupby(iter_native_bands(spec, style_index, profile, workers), lambda item: item[0].sheet):
+            _, last_column, last_row = sheets[sheet]
+            with zf.open(f"xl/worksheets/sheet{sheet + 1}.xml", "w") as f:
+                f.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                    '<sheetPr><pageSetUpPr fitToPage="1"/></sheetPr>'
+                    f'<dimension ref="A1:{column_letter(last_column)}{last_row}"/>'
+                    '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+                    '<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>'
+                    f'<cols><col min="1" max="{last_column}" width="{spec.column_width}" customWidth="1"/></cols>'
+                    '<sheetData>'
+                ).encode())
+                merges = []
+                for _, rows, band_merges in bands:
+                    f.write(rows.encode())
+                    merges.extend(band_merges)
+                # Stacked bands are fitted to the page width and printed on as many pages as they need
+                fit_to_height = ' fitToHeight="0"' if last_row > 9 else ""
+                f.write((
+                    '</sheetData>'
+                    f'<mergeCells count="{len(merges)}">{"".join(merges)}</mergeCells>'
+                    '<printOptions horizontalCentered="1" verticalCentered="1"/>'
+                    '<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>'
+                    f'<pageSetup paperSize="9"{fit_to_height} orientation="landscape"/>'
+                    '</worksheet>'
+                ).encode())
+
+
+def get_native_band_xml(band: Band, layout: SheetLayout, style_index: dict[tuple, int],
+                        row_height: float) -> tuple[str, list[str]]:
+    # Returns the rows of a band as sheet XML and its merged ranges as mergeCell elements
+    letters = [column_letter(col) for col in range(1, layout.last_column + 1)]
+    cells = []
+    for row in range(band.row + 1, band.row + 10):
+        cells.append(f'<row r="{row}" ht="{row_height}" customHeight="1">')
+        for letter, (value, style) in zip(letters, layout.iter_row(row - band.row)):
+            if value is None:
+                cells.append(f'<c r="{letter}{row}" s="{style_index[style]}"/>')
+            elif isinstance(value, str):
+                cells.append(f'<c r="{letter}{row}" s="{style_index[style]}" t="inlineStr">'
+                             f'<is><t>{xml_escape(value)}</t></is></c>')
+            else:
+                cells.append(f'<c r="{letter}{row}" s="{style_index[style]}"><v>{value}</v></c>')
+        cells.append("</row>")
+    merges = [f'<mergeCell ref="{letters[start_col - 1]}{band.row + start_row}:'
+              f'{letters[end_col - 1]}{band.row + end_row}"/>'
+              for start_row, start_col, end_row, end_col in layout.merges]
+    return "".join(cells), merges
+
+
+# Bands of at least this many weeks are rendered per task of a band worker process
+native_chunk_weeks = 520
+
+
+def iter_native_bands(spec: CalendarSpec, style_index: dict[tuple, int], profile: Profile | None = None,
+                      workers: int = 1) -> Iterator[tuple[Band, str, list[str]]]:
+    # Yields every band of the calendar with its rows as sheet XML and its merged ranges, in band order
+    # With more than one worker and more than one chunk of bands, the chunks are rendered on a pool of worker
+    # processes. Only a few chunks per worker are in flight, so memory stays bounded however long the calendar is.
+    chunks = iter_band_chunks(spec)
+    first_chunks = list(islice(chunks, 2))
+    if workers <= 1 or len(first_chunks) == 1:
+        for band, layout in iter_layouts(spec, profile):
+            yield band, *get_native_band_xml(band, layout, style_index, spec.row_height)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    holiday_definitions = [holiday_sets[name].definition for name in spec.holidays]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_band_worker,
+                             initargs=(holiday_definitions,)) as executor:
+        pending = deque()
+        for chunk in chain(first_chunks, chunks):
+            pending.append(executor.submit(render_native_bands, spec, chunk, style_index, profile is not None))
+            if len(pending) > 2 * workers:
+                yield from get_native_chunk(pending.popleft(), profile)
+        while pending:
+            yield from get_native_chunk(pending.popleft(), profile)
+
+
+def get_native_chunk(future, profile: Profile | None) -> list[tuple[Band, str, list[str]]]:
+    # Returns the bands of a chunk rendered by a band worker process, adding their counts to the profile
+    bands, counts = future.result()
+    if profile:
+        profile.add_counts(counts)
+    return bands
+
+
+def iter_band_chunks(spec: CalendarSpec) -> Iterator[list[Band]]:
+    # Yields the bands of the calendar in chunks of at least native_chunk_weeks weeks
+    chunk = []
+    weeks = 0
+    for band in iter_bands(spec):
+        chunk.append(band)
+        weeks += band.weeks
+        if weeks >= native_chunk_weeks:
+            yield chunk
+            chunk = []
+            weeks = 0
+    if chunk:
+        yield chunk
+
+
+def init_band_worker(holiday_definitions: list[dict]) -> None:
+    # Passes the holiday sets of the calendar to a band worker process, as workers that are spawned only know the
+    # built-in sets
+    for definition in holiday_definitions:
+        add_holiday_set(definition)
+
+
+def render_native_bands(spec: CalendarSpec, bands: list[Band], style_index: dict[tuple, int],
+                        profiled: bool = False) -> tuple[list[tuple[Band, str, list[str]]], Profile | None]:
+    # Renders the rows and merged ranges of a chunk of bands in a band worker process, with a profile holding their
+    # counts if the render is profiled
+    marks = get_marks(spec.marks)
+    counts = Profile() if profiled else None
+    rendered = []
+    for band in bands:
+        layout = get_layout(spec, band=band, marks=marks)
+        if counts:
+            counts.count_layout(layout)
+        rendered.append((band, *get_native_band_xml(band, layout, style_index, spec.row_height)))
+    return rendered, counts
 
 
 if __name__ == "__main__":
+    # Needed for the batch worker processes in the pyinstaller executable
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()
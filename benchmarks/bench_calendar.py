@@ -0,0 +1,221 @@
+""" Benchmarks of the XLCalendar pipeline stages
+
+Every case (span x holidays x language) runs in fresh processes, once for the separate stages and once for the
+end-to-end render, so caches start cold and the peak RSS belongs to that case alone. Results are written as JSON and
+can be compared with the results of an earlier version.
+
+Usage:
+    python benchmarks/bench_calendar.py [options]
+
+Options:
+    --spans <N> [<N> ...]       Spans in years to run. (Default: 1 10 50 100)
+    --langs <lang> [...]        Languages to run. (Default: nl fr)
+    --renderer <std | lowmem | native>
+                                Renderer to benchmark. (Default: std)
+    --band <year | N>           Split the calendars into bands of a year or of N weeks. (Default: no bands)
+    --compress <0-9>            Compress the files with level 0 (stored) to 9. (Default: 6)
+    --repeat <N>                Runs per measurement, the fastest counts. (Default: 3)
+    --output <file>             Write the results to <file>. (Default: 'bench_results.json')
+    --compare <file>            Compare the results with earlier results in <file>.
+"""
+
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import XLCalendar
+from XLCalendar import CalendarSpec, DayGrid, SheetLayout, get_month_length, get_names
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is not reported there
+    resource = None
+
+
+def get_peak_rss_kb() -> int | None:
+    # Returns the peak resident set size of this process in KiB
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def get_case_spec(span: int, holidays: bool, lang: str, renderer: str, band: int | str | None = None,
+                  compress_level: int | None = None) -> CalendarSpec:
+    # Returns the spec of a calendar of exactly <span> years
+    return CalendarSpec(2000, 1, 2000 + span - 1, 12, lang=lang, holidays=("nl",) if holidays else (),
+                        renderer=renderer, band=band, compress_level=compress_level)
+
+
+def measure(function, repeat: int, setup=None) -> tuple[dict, object]:
+    # Runs the function <repeat> times and returns the fastest and median wall and CPU time with the last result
+    walls, cpus = [], []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        result = function()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    walls.sort()
+    return {"wall_min": min(walls), "wall_median": walls[len(walls) // 2], "cpu_min": min(cpus)}, result
+
+
+def clear_caches() -> None:
+    XLCalendar.get_easter_date.cache_clear()
+    XLCalendar.get_holiday_table.cache_clear()
+    XLCalendar.get_rule_index.cache_clear()
+    XLCalendar.get_year_ordinals.cache_clear()
+
+
+def run_stages(spec: CalendarSpec, repeat: int) -> dict:
+    # Measures the pipeline stages one at a time, each stage feeding on the result of the one before
+    stages = {}
+    years = range(max(spec.year_start - 1, 1), min(spec.year_end + 1, 9999) + 1)
+
+    stages["easter"], _ = measure(lambda: [XLCalendar.get_easter_date(year) for year in years], repeat, clear_caches)
+    stages["easter_range"], _ = measure(lambda: XLCalendar.get_easter_ordinals(years), repeat)
+
+    def get_holidays() -> list[frozenset[int]]:
+        return [XLCalendar.get_holiday_index(years[0], years[-1], name) for name in spec.holidays]
+    stages["holidays"], holidays = measure(get_holidays, repeat, clear_caches)
+
+    first_day = XLCalendar.datetime.date(spec.year_start, spec.month_start, 1)
+    last_day = XLCalendar.datetime.date(spec.year_end, spec.month_end, get_month_length(spec.year_end, spec.month_end))
+    stages["day_grid"], grid = measure(lambda: DayGrid(first_day, last_day, holidays), repeat)
+
+    weekday_dict, month_dict = get_names(spec.lang)
+    fills = tuple(XLCalendar.holiday_sets[name].fill for name in spec.holidays)
+    stages["layout"], layout = measure(lambda: SheetLayout(grid, weekday_dict, month_dict, spec.year_start, fills),
+                                       repeat)
+
+    # The renderers lay out the bands themselves as they write them, so the cell-writing stage includes the layout
+    if spec.renderer == "native":
+        # The native writer produces the file in one go, so there is no separate cell-writing stage
+        stream = io.BytesIO()
+        stages["save"], _ = measure(lambda: XLCalendar.write_native_workbook(spec, stream), repeat,
+                                    lambda: stream.seek(0) or stream.truncate())
+    else:
+        build = XLCalendar.build_write_only_workbook if spec.renderer == "lowmem" else XLCalendar.build_workbook
+        stages["cells"], _ = measure(lambda: build(spec), repeat)
+
+        # Write-only workbooks can only be saved once, so every save gets a fresh workbook outside the timing
+        workbooks = []
+        stream = io.BytesIO()
+
+        def new_workbook() -> None:
+            workbooks.append(build(spec))
+            stream.seek(0)
+            stream.truncate()
+        stages["save"], _ = measure(lambda: XLCalendar.save_workbook(workbooks[-1], stream, spec.compress_level),
+                                    repeat, new_workbook)
+
+    return {"stages": stages, "grid_bytes_per_day": grid.nbytes() / len(grid), "output_bytes": len(stream.getvalue()),
+            "peak_rss_kb": get_peak_rss_kb()}
+
+
+def run_end_to_end(spec: CalendarSpec, repeat: int) -> dict:
+    # Measures render() from the spec to the bytes of the file, the first run with cold caches
+    timing, data = measure(lambda: XLCalendar.render(spec), repeat, clear_caches)
+    return {"end_to_end": timing, "output_bytes": len(data), "peak_rss_kb": get_peak_rss_kb()}
+
+
+def run_case(case: dict, mode: str, repeat: int) -> dict:
+    # Runs one case in a fresh process and returns its measurements
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case), mode, str(repeat)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout)
+
+
+def run_benchmarks(spans: list[int], langs: list[str], renderer: str, band: int | str | None,
+                   compress_level: int | None, repeat: int) -> dict:
+    # Runs every case and returns the results with a description of the environment
+    results = []
+    for span in spans:
+        for holidays in (False, True):
+            for lang in langs:
+                case = {"span": span, "holidays": holidays, "lang": lang, "renderer": renderer, "band": band,
+                        "compress_level": compress_level}
+                stages = run_case(case, "stages", repeat)
+                end_to_end = run_case(case, "end_to_end", repeat)
+                results.append({**case,
+                                "stages": stages["stages"],
+                                "grid_bytes_per_day": stages["grid_bytes_per_day"],
+                                "end_to_end": end_to_end["end_to_end"],
+                                "output_bytes": end_to_end["output_bytes"],
+                                "peak_rss_kb": {"stages": stages["peak_rss_kb"],
+                                                "end_to_end": end_to_end["peak_rss_kb"]}})
+                print(f"{span:>4} years  holidays {'on ' if holidays else 'off'}  {lang}  "
+                      f"{end_to_end['end_to_end']['wall_min']:8.3f} s  "
+                      f"{end_to_end['output_bytes']:>9} bytes  {end_to_end['peak_rss_kb'] or '-':>8} KiB")
+    return {"version": XLCalendar.opt['VERSION'],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "results": results}
+
+
+def compare(old: dict, new: dict) -> None:
+    # Prints the end-to-end and stage times of the new results relative to the old ones
+    print(f"\nversion {old['version']} -> {new['version']} (ratio new / old, < 1 is faster)")
+    old_results = {(r["span"], r["holidays"], r["lang"], r["renderer"], r.get("band"), r.get("compress_level")): r
+                   for r in old["results"]}
+    for result in new["results"]:
+        key = (result["span"], result["holidays"], result["lang"], result["renderer"], result.get("band"),
+               result.get("compress_level"))
+        if key not in old_results:
+            continue
+        before = old_results[key]
+        ratios = [f"end_to_end {result['end_to_end']['wall_min'] / before['end_to_end']['wall_min']:.2f}"]
+        for stage, timing in result["stages"].items():
+            if stage in before["stages"] and before["stages"][stage]["wall_min"]:
+                ratios.append(f"{stage} {timing['wall_min'] / before['stages'][stage]['wall_min']:.2f}")
+        print(f"{key[0]:>4} years  holidays {'on ' if key[1] else 'off'}  {key[2]}  {key[3]}  " + "  ".join(ratios))
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--run-case":
+        # Child process: run one case and report on stdout
+        case = json.loads(sys.argv[2])
+        spec = get_case_spec(case["span"], case["holidays"], case["lang"], case["renderer"], case["band"],
+                             case["compress_level"])
+        run = run_stages if sys.argv[3] == "stages" else run_end_to_end
+        print(json.dumps(run(spec, int(sys.argv[4]))))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the XLCalendar pipeline stages")
+    parser.add_argument("--spans", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--langs", nargs="+", choices=tuple(XLCalendar.get_locale_catalog()), default=["nl", "fr"])
+    parser.add_argument("--renderer", choices=XLCalendar.renderers, default="std")
+    parser.add_argument("--band", type=lambda band: band if band == "year" else int(band))
+    parser.add_argument("--compress", type=int, choices=range(10))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.spans, args.langs, args.renderer, args.band, args.compress, args.repeat)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved as: '{args.output}'")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(json.load(file), results)
+
+
+if __name__ == "__main__":
+    main()
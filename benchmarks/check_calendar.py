@@ -0,0 +1,285 @@
+""" Consistency checks of the fast paths of XLCalendar
+
+The vectorized and per-rule paths that make long timespans fast are checked against the plain per-year functions
+they replace, over the whole datetime range, and the counts of the working-day index against counting day by day.
+Calendars in bands are rendered at both ends of the datetime range, and the workbooks of the low memory and native
+renderers are loaded back and compared with those of the standard renderer, cell for cell, as are calendars extended
+with --extend with calendars rendered at once. Exits with status 1 if any check fails.
+
+Usage:
+    python benchmarks/check_calendar.py
+"""
+
+
+import datetime
+import io
+import os
+import random
+import sys
+import tempfile
+from itertools import chain
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import XLCalendar
+
+# Rules that take every branch of the per-rule evaluation: leap days, days past the 28th, fifth and last weekdays,
+# year limits, offsets and substitutes
+edge_rules = {"name": "check_edges", "rules": [
+    {"name": "Leap day", "type": "fixed", "month": 2, "day": 29, "substitute": {"sat": 2, "sun": 1}},
+    {"name": "January 31st", "type": "fixed", "month": 1, "day": 31, "offset": 3},
+    {"name": "Last Sunday of February", "type": "nth_weekday", "month": 2, "weekday": "sun", "n": -1},
+    {"name": "Fifth Monday of February", "type": "nth_weekday", "month": 2, "weekday": "mon", "n": 5},
+    {"name": "Fifth last Friday of March", "type": "nth_weekday", "month": 3, "weekday": "fri", "n": -5,
+     "from": 1700, "until": 8000},
+    {"name": "Eve of fourth Wednesday of December", "type": "nth_weekday", "month": 12, "weekday": "wed", "n": 4,
+     "offset": -1},
+    {"name": "Easter + 60", "type": "easter", "offset": 60, "substitute": {"thu": 1}}]}
+
+# Timespans checked per holiday set, the first spanning the whole datetime range
+holiday_spans = ((1, 9999), (1, 1), (1, 40), (1583, 1600), (1900, 1900), (2024, 2030), (9990, 9999))
+
+# Working-day indexes checked: years, holiday sets and weekend, with queries running outside the indexed years
+index_cases = ((2000, 2020, ("nl",), (6, 7)), (2000, 2020, ("be", "de", "check_edges"), (6, 7)),
+               (1, 3, ("gb",), (5, 6)), (9990, 9999, ("us",), (7,)))
+index_queries = 500
+
+# Calendars in bands at both ends of the datetime range: first and last month and year, and the bands to split into
+band_cases = ((1, 1, 1, 12), (9999, 11, 9999, 12), (9998, 1, 9999, 12))
+band_sizes = (1, 2, 3, 52, "year")
+
+# Calendars rendered by every renderer: first and last month and year, holiday sets, language, band and band sheets
+renderer_cases = ((1, 2024, 6, 2025, ("nl", "de"), None, None, False),
+                  (11, 2023, 2, 2026, ("be",), "fr", "year", False),
+                  (3, 2024, 9, 2025, ("gb", "us"), "de", 10, False),
+                  (1, 2024, 12, 2025, ("nl",), None, "year", True),
+                  (5, 2024, 4, 2025, (), "es", 8, True))
+
+# Calendars extended: first and last month and year, the month and year extended to, holiday sets, language and the
+# renderer of the calendar extended. The extension detects the language from the sheet.
+extend_cases = ((1, 2024, 6, 2024, 12, 2025, ("nl",), None, "std"),
+                (3, 2024, 4, 2024, 5, 2024, ("be", "de"), "nl", "native"),
+                (11, 2023, 1, 2024, 3, 2026, (), "fr", "lowmem"),
+                (1, 2024, 2, 2024, 2, 2024, ("gb",), "de", "native"),
+                (6, 2024, 9, 2024, 1, 2025, ("us",), "es", "std"))
+
+# Dates marked in the calendars of the renderer and extend cases
+mark_lines = ("start,end,category,fill", "2024-02-14,,Valentine,FF99CC", "2024-07-01,2024-07-19,Holiday,",
+              "2025-03-03,2025-03-07,Holiday,", "2025-12-24,2026-01-02,Closed,C0C0C0")
+
+
+def check_easter() -> list[str]:
+    # Returns the years from 1583 on where the vectorized Easter ordinals differ from get_easter_date()
+    years = range(1583, 10000)
+    return [f"Easter {year}: {ordinal} != {XLCalendar.get_easter_date(year).toordinal()}"
+            for year, ordinal in zip(years, XLCalendar.get_easter_ordinals(years))
+            if ordinal != XLCalendar.get_easter_date(year).toordinal()]
+
+
+def check_holiday_tables() -> list[str]:
+    # Returns the holiday sets and timespans where the holidays evaluated per rule differ from the tables per year
+    failures = []
+    for holiday_set, definition in XLCalendar.holiday_sets.items():
+        for year_start, year_end in holiday_spans:
+            per_rule = frozenset(chain.from_iterable(XLCalendar.get_rule_ordinals(rule, year_start, year_end)
+                                                     for rule in definition.rules))
+            per_year = frozenset().union(*(XLCalendar.get_holiday_table(year, holiday_set)
+                                           for year in range(year_start, year_end + 1)))
+            if per_rule != per_year:
+                failures.append(f"Holidays '{holiday_set}' {year_start}-{year_end}: "
+                                f"{len(per_rule ^ per_year)} days differ")
+    return failures
+
+
+def is_working_day(ordinal: int, holidays: tuple[str, ...], weekend: tuple[int, ...]) -> bool:
+    # Returns whether the day is a working day, looked up in the tables per year around it
+    date = datetime.date.fromordinal(ordinal)
+    if date.isoweekday() in weekend:
+        return False
+    return not any(ordinal in XLCalendar.get_holiday_table(year, holiday_set) for holiday_set in holidays
+                   for year in range(max(date.year - 1, 1), min(date.year + 1, 9999) + 1))
+
+
+def check_calendar_index() -> list[str]:
+    # Returns the queries where the working-day index differs from checking the days one by one
+    failures = []
+    rng = random.Random(0)
+    max_ordinal = datetime.date.max.toordinal()
+    for year_start, year_end, holidays, weekend in index_cases:
+        index = XLCalendar.CalendarIndex(year_start, year_end, holidays, weekend)
+        pairs, counts = [], []
+        low = datetime.date(max(year_start - 5, 1), 1, 1).toordinal()
+        high = datetime.date(min(year_end + 5, 9999), 12, 31).toordinal()
+        for _ in range(index_queries):
+            first = rng.randint(low, high)
+            end = min(max(first + rng.randint(-400, 400), 1), max_ordinal)
+            count = sum(is_working_day(o, holidays, weekend) for o in range(min(first, end), max(first, end)))
+            count = count if end >= first else -count
+            result = index.count_working_days(datetime.date.fromordinal(first), datetime.date.fromordinal(end))
+            if result != count:
+                failures.append(f"Working days {first}-{end} {holidays}: {result} != {count}")
+            pairs.append((datetime.date.fromordinal(first), datetime.date.fromordinal(end)))
+            counts.append(count)
+
+            days = rng.randint(-100, 100)
+            o, left = first, days
+            while left and 1 < o < max_ordinal:
+                o += 1 if days > 0 else -1
+                left -= (1 if days > 0 else -1) * is_working_day(o, holidays, weekend)
+            if not left:
+                result = index.add_working_days(datetime.date.fromordinal(first), days).toordinal()
+                if result != o:
+                    failures.append(f"Add {days} working days to {first} {holidays}: {result} != {o}")
+
+        # The bulk queries of a fresh index, which extends it from the first query on
+        index = XLCalendar.CalendarIndex(year_start, year_end, holidays, weekend)
+        first_days, end_days = zip(*pairs)
+        if index.count_working_days_many(first_days, end_days) != counts:
+            failures.append(f"Bulk working days {year_start}-{year_end} {holidays} differ")
+        flags = [is_working_day(date.toordinal(), holidays, weekend) for date in first_days]
+        if index.is_working_day_many(first_days) != flags:
+            failures.append(f"Bulk working day flags {year_start}-{year_end} {holidays} differ")
+
+    # Empty spans at the first and last day of the datetime range
+    index = XLCalendar.CalendarIndex(1, 1)
+    for date in (datetime.date.min, datetime.date.max):
+        try:
+            if index.count_working_days_many([date], [date]) != [0] or index.count_working_days(date, date) != 0:
+                failures.append(f"Working days from {date} to itself aren't 0")
+        except ValueError as e:
+            failures.append(f"Working days from {date} to itself: {e}")
+    return failures
+
+
+def check_bands() -> list[str]:
+    # Returns the specs at the ends of the datetime range whose bands don't cover the padded weeks one after another,
+    # or that fail to render
+    failures = []
+    for year_start, month_start, year_end, month_end in band_cases:
+        for band in band_sizes:
+            for band_sheets in (False, True):
+                spec = XLCalendar.CalendarSpec(year_start, month_start, year_end, month_end, holidays=("nl",),
+                                               renderer="native", band=band, band_sheets=band_sheets)
+                title = f"{month_start}-{year_start} to {month_end}-{year_end} band {band} sheets {band_sheets}"
+                try:
+                    bands = list(XLCalendar.iter_bands(spec))
+                    XLCalendar.render_to(spec, io.BytesIO())
+                except (ValueError, OverflowError) as e:
+                    failures.append(f"{title}: {e}")
+                    continue
+                first_day = datetime.date(year_start, month_start, 1).toordinal()
+                monday = first_day - (first_day - 1) % 7
+                for b in bands:
+                    if b.first_monday != monday or not 1 <= b.year <= 9999:
+                        failures.append(f"{title}: band at {b.first_monday} of {b.year} doesn't follow {monday}")
+                    monday = b.first_monday + 7 * b.weeks
+    return failures
+
+
+def dump_workbook(data: bytes) -> list[dict]:
+    # Returns the values and styles of the non-empty cells, the merged ranges, dimensions and page setup of every
+    # sheet of a workbook, as loaded back by openpyxl
+    import openpyxl
+
+    def get_side(side) -> tuple | None:
+        return (side.style, side.color.rgb if side.color is not None else None) if side and side.style else None
+
+    sheets = []
+    for ws in openpyxl.load_workbook(io.BytesIO(data)).worksheets:
+        cells = {}
+        for row in ws.iter_rows():
+            for cell in row:
+                font, fill, alignment, border = cell.font, cell.fill, cell.alignment, cell.border
+                value = (cell.value, font.name, font.sz, bool(font.b), fill.fill_type,
+                         fill.fgColor.rgb if fill.fill_type else None, alignment.horizontal, alignment.vertical,
+                         get_side(border.left), get_side(border.right), get_side(border.top), get_side(border.bottom))
+                if cell.value is not None or any(value[4:]):
+                    cells[cell.coordinate] = value
+        sheets.append({"title": ws.title, "cells": cells,
+                       "merges": sorted(str(merged) for merged in ws.merged_cells.ranges),
+                       "widths": {column: dimension.width for dimension in ws.column_dimensions.values()
+                                  if dimension.customWidth for column in range(dimension.min, dimension.max + 1)},
+                       "heights": {key: dimension.height for key, dimension in ws.row_dimensions.items()
+                                   if dimension.height is not None},
+                       "print_area": ws.print_area, "orientation": ws.page_setup.orientation,
+                       "paper_size": ws.page_setup.paperSize, "fit_to_page": ws.sheet_properties.pageSetUpPr.fitToPage,
+                       "centered": (ws.print_options.horizontalCentered, ws.print_options.verticalCentered)})
+    return sheets
+
+
+def compare_workbooks(title: str, expected: list[dict], actual: list[dict]) -> list[str]:
+    # Returns the differences between two dumped workbooks
+    if len(expected) != len(actual):
+        return [f"{title}: {len(actual)} sheets instead of {len(expected)}"]
+    failures = []
+    for expected_sheet, actual_sheet in zip(expected, actual):
+        for key, value in expected_sheet.items():
+            if key == "cells":
+                cells = sorted(coordinate for coordinate in value.keys() | actual_sheet[key].keys()
+                               if value.get(coordinate) != actual_sheet[key].get(coordinate))
+                if cells:
+                    failures.append(f"{title}: sheet '{expected_sheet['title']}' differs in {len(cells)} cells, "
+                                    f"{cells[0]}: {actual_sheet[key].get(cells[0])} != {value.get(cells[0])}")
+            elif actual_sheet[key] != value:
+                failures.append(f"{title}: sheet '{expected_sheet['title']}' differs in {key}")
+    return failures
+
+
+def check_renderers() -> list[str]:
+    # Returns the calendars where the low memory or native renderer makes another workbook than the standard one
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        mark_file = os.path.join(directory, "marks.csv")
+        with open(mark_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(mark_lines))
+        for month_start, year_start, month_end, year_end, holidays, lang, band, band_sheets in renderer_cases:
+            spec = XLCalendar.CalendarSpec(year_start, month_start, year_end, month_end, lang=lang, holidays=holidays,
+                                           marks=(mark_file,), band=band, band_sheets=band_sheets)
+            expected = dump_workbook(XLCalendar.render(spec))
+            for renderer in ("lowmem", "native"):
+                title = f"{spec.title} band {band} sheets {band_sheets} {renderer}"
+                actual = dump_workbook(XLCalendar.render(spec._replace(renderer=renderer)))
+                failures.extend(compare_workbooks(title, expected, actual))
+    return failures
+
+
+def check_extend() -> list[str]:
+    # Returns the calendars that differ when extended from the workbook of a shorter calendar rather than rendered at
+    # once
+    import openpyxl
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        mark_file = os.path.join(directory, "marks.csv")
+        with open(mark_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(mark_lines))
+        for month_start, year_start, month_end, year_end, month_to, year_to, holidays, lang, renderer in extend_cases:
+            spec = XLCalendar.CalendarSpec(year_start, month_start, year_end, month_end, lang=lang, holidays=holidays,
+                                           marks=(mark_file,), renderer=renderer)
+            wb = openpyxl.load_workbook(io.BytesIO(XLCalendar.render(spec)))
+            XLCalendar.extend_workbook(wb, year_to, month_to, holidays, (mark_file,))
+            stream = io.BytesIO()
+            XLCalendar.save_workbook(wb, stream)
+            expected = dump_workbook(XLCalendar.render(spec._replace(year_end=year_to, month_end=month_to)))
+            title = f"{spec.title} extended to {month_to}-{year_to} {renderer}"
+            failures.extend(compare_workbooks(title, expected, dump_workbook(stream.getvalue())))
+    return failures
+
+
+def main() -> None:
+    XLCalendar.add_holiday_set(edge_rules)
+    checks = {"Easter dates": check_easter, "Holiday tables": check_holiday_tables,
+              "Working-day index": check_calendar_index, "Bands": check_bands, "Renderers": check_renderers,
+              "Extend": check_extend}
+
+    failed = False
+    for title, check in checks.items():
+        failures = check()
+        print(f"{title}: {'FAILED' if failures else 'OK'}")
+        for failure in failures[:10]:
+            print(f"    {failure}")
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()